@@ -1,4 +1,13 @@
+import cProfile
+import json
+import os
+import pstats
+import queue
 import random
+import time
+import ChessEngine, ChessBook, ChessTablebase
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from multiprocessing import Pipe, Process, Value
 
 pieceScore = {"K": 0, "Q": 10, "R": 5, "B": 3, "N": 3, "p": 1}
 
@@ -77,12 +86,134 @@ whiteKingScores =  [[0, 0, 0, 0, 0, 0, 0, 0],
 
 
 piecePositionScores = {"N": knightScores, "B":bishopScores, "Q": queenScores, "R": rookScores, "bp": blackPawnScores, "wp": whitePawnScores, "wK": whiteKingScores, "bK": blackKingScores}
+CENTIPAWNS_PER_PAWN = 100
+POSITION_SCORE_WEIGHT = 10 #centipawns per point in the piece position tables
+EVALUATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "evaluation.json") #tuned weights, see ChessTuner
 
+'''
+Converts pieceScore and piecePositionScores into the centipawn tables every GameState keeps its running evaluation
+with. Call it again after changing the weights. The knight, bishop, rook and queen tables are from white's side of the
+board, black uses them upside down. Scores are rounded to whole centipawns, so tuned weights can have fractions
+'''
+def updateEvaluationTables():
+    materialValues = {}
+    positionValues = {}
+    for color, sign in (("w", 1), ("b", -1)):
+        for piece in pieceScore:
+            if piece in "pK":
+                table = piecePositionScores[color + piece]
+            else:
+                table = piecePositionScores[piece] if color == "w" else piecePositionScores[piece][::-1]
+            materialValues[color + piece] = round(sign * pieceScore[piece] * CENTIPAWNS_PER_PAWN)
+            positionValues[color + piece] = [[round(sign * score * POSITION_SCORE_WEIGHT) for score in row] for row in table]
+    ChessEngine.setEvaluationTables(materialValues, positionValues)
 
+'''
+Writes pieceScore and piecePositionScores to a JSON parameter file
+'''
+def saveEvaluation(path=EVALUATION_PATH):
+    with open(path, "w") as file:
+        json.dump({"pieceScore": pieceScore, "piecePositionScores": piecePositionScores}, file, indent=1)
 
-CHECKMATE = 1000
+'''
+Reads weights written by saveEvaluation and makes them the ones the engine plays with. Pieces or tables the file
+leaves out keep their values
+'''
+def loadEvaluation(path=EVALUATION_PATH):
+    with open(path) as file:
+        parameters = json.load(file)
+    pieceScore.update(parameters.get("pieceScore", {}))
+    for key, table in parameters.get("piecePositionScores", {}).items():
+        if key not in piecePositionScores or len(table) != 8 or any(len(row) != 8 for row in table):
+            raise ValueError("bad piece position table " + key + " in " + path)
+        piecePositionScores[key] = table
+    updateEvaluationTables()
+
+if os.path.exists(EVALUATION_PATH):
+    loadEvaluation(EVALUATION_PATH)
+else:
+    updateEvaluationTables()
+
+
+CHECKMATE = 100000 #centipawns, the search scores a mate CHECKMATE minus the plies to it so nearer mates score higher
 STALEMATE = 0
-DEPTH = 3
+DEPTH = 3 #fixed depth used by the older minmax/negamax searches
+MAX_DEPTH = 64 #iterative deepening stops here even if there is time left
+TIME_LIMIT = 2.0 #seconds the AI may think per move, None for no limit
+NODE_LIMIT = None #nodes the AI may search per move, None for no limit
+PARALLEL_WORKERS = os.cpu_count() or 1 #processes findBestMoveParallel splits the root moves across
+STOP_CHECK_MASK = 1023 #the clock and the stop request are looked at once every 1024 nodes
+STOP_POLL_SECONDS = 0.05 #how often the parallel search asks its stopCondition while waiting on the workers
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin") #Polyglot opening book, used if it's there
+TABLEBASE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "syzygy") #Syzygy .rtbw/.rtbz files
+TABLEBASE_WIN = CHECKMATE // 2 #score of a tablebase win, below the mates the search finds itself
+DISTANCE_SCORE = TABLEBASE_WIN - 1000 #scores beyond this are mates or tablebase wins, counted in plies from the root
+PROFILED_FUNCTIONS = ("getValidMoves", "getValidCaptures", "makeMove", "undoMove", "scoreBoard") #reported when profiling
+
+#transposition table bound types
+EXACT = 0
+LOWERBOUND = 1 #score is at least this (search failed high)
+UPPERBOUND = 2 #score is at most this (search failed low)
+TT_SIZE_MB = 16
+TT_ENTRY_BYTES = 150 #rough size of one stored tuple and its ints
+
+'''
+Fixed size hash table of searched positions, indexed by the zobrist key of the GameState.
+Each slot holds (key, depth, bound, score, bestMoveID, generation). A slot is replaced when it is empty, holds the
+same position, was stored by an older search, or was searched less deep than the new entry.
+'''
+class TranspositionTable():
+
+    def __init__(self, entries=None, sizeMB=TT_SIZE_MB):
+        if entries is None:
+            entries = max(1, sizeMB * 1024 * 1024 // TT_ENTRY_BYTES)
+        self.size = entries
+        self.table = [None] * entries
+        self.generation = 0
+
+    def probe(self, key):
+        entry = self.table[key % self.size]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, bound, score, bestMove):
+        index = key % self.size
+        entry = self.table[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.table[index] = (key, depth, bound, score, bestMove.moveID if bestMove is not None else None, self.generation)
+
+    '''
+    Called at the start of every search so entries from earlier searches are replaced first
+    '''
+    def newSearch(self):
+        self.generation += 1
+
+    def clear(self):
+        self.table = [None] * self.size
+        self.newSearch()
+
+'''
+Mate and tablebase scores count plies from the root, the transposition table keeps them counted from the position
+stored instead, so they are still right when the position comes up at another ply
+'''
+def scoreToTable(score, ply):
+    if score >= DISTANCE_SCORE:
+        return score + ply
+    if score <= -DISTANCE_SCORE:
+        return score - ply
+    return score
+
+def scoreFromTable(score, ply):
+    if score >= DISTANCE_SCORE:
+        return score - ply
+    if score <= -DISTANCE_SCORE:
+        return score + ply
+    return score
+
+transpositionTable = TranspositionTable() #shared by every search that isn't given a table of its own
+openingBook = ChessBook.OpeningBook(BOOK_PATH) #opened on the first lookup, not at import
+endgameTablebase = ChessTablebase.Tablebase(TABLEBASE_DIRECTORY) #opened on the first probe
 
 '''
 Picks and returns a random move.
@@ -126,21 +257,575 @@ def findBestMoveMinMaxNoRecursion(gs, validMoves):
     return bestPlayerMove
 
 '''
-Helper method to make first recursive call
+Raised inside the search when the time or node budget runs out
+'''
+class SearchTimeout(Exception):
+    pass
+
+'''
+What a search did, returned by findBestMove instead of being printed. depths gets one entry per finished depth
+'''
+class SearchStats():
+
+    def __init__(self):
+        self.nodes = 0 #quiescence nodes included
+        self.qnodes = 0
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0 #cutoffs caused by the first move searched, a measure of the move ordering
+        self.tablebaseHits = 0
+        self.nullMoveCutoffs = 0
+        self.reducedMoves = 0 #moves searched shallower by the late move reductions
+        self.researches = 0 #zero window and reduced searches that had to be repeated at full width and depth
+        self.depths = [] #{"depth", "score", "nodes", "seconds", "pv"} for each finished depth
+        self.seconds = 0.0
+        self.bestMove = None
+        self.fromBook = False #the move came from the opening book, nothing was searched
+        self.fromTablebase = False #the move came from the endgame tablebase, nothing was searched
+        self.profile = None #{function name: (calls, own seconds, seconds including callees)} when profiled
+
+    '''
+    Adds the counters of another search, used to total up the workers of the parallel search
+    '''
+    def merge(self, other):
+        self.nodes += other.nodes
+        self.qnodes += other.qnodes
+        self.ttProbes += other.ttProbes
+        self.ttHits += other.ttHits
+        self.betaCutoffs += other.betaCutoffs
+        self.firstMoveCutoffs += other.firstMoveCutoffs
+        self.tablebaseHits += other.tablebaseHits
+        self.nullMoveCutoffs += other.nullMoveCutoffs
+        self.reducedMoves += other.reducedMoves
+        self.researches += other.researches
+
+    def addDepth(self, depth, score, seconds, pv):
+        self.depths.append({"depth": depth, "score": score, "nodes": self.nodes, "seconds": round(seconds, 4),
+                            "pv": [move.getChessNotation() for move in pv]})
+
+    '''
+    Keeps the calls and times of PROFILED_FUNCTIONS from a cProfile run
+    '''
+    def addProfile(self, profiler):
+        self.profile = {}
+        for (fileName, line, name), (primitiveCalls, calls, ownTime, totalTime, callers) in pstats.Stats(profiler).stats.items():
+            if name in PROFILED_FUNCTIONS:
+                previous = self.profile.get(name, (0, 0.0, 0.0))
+                self.profile[name] = (previous[0] + calls, previous[1] + ownTime, previous[2] + totalTime)
+
+    def nps(self):
+        return self.nodes / self.seconds if self.seconds > 0 else 0.0
+
+    def ttHitRate(self):
+        return self.ttHits / self.ttProbes if self.ttProbes else 0.0
+
+    def firstMoveCutoffRate(self):
+        return self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs else 0.0
+
+    def asDict(self):
+        return {"bestMove": self.bestMove, "fromBook": self.fromBook, "fromTablebase": self.fromTablebase, "nodes": self.nodes,
+                "qnodes": self.qnodes, "ttProbes": self.ttProbes, "ttHits": self.ttHits, "betaCutoffs": self.betaCutoffs,
+                "firstMoveCutoffRate": round(self.firstMoveCutoffRate(), 4), "tablebaseHits": self.tablebaseHits,
+                "nullMoveCutoffs": self.nullMoveCutoffs, "reducedMoves": self.reducedMoves, "researches": self.researches,
+                "seconds": round(self.seconds, 4), "nps": round(self.nps()), "depths": self.depths, "profile": self.profile}
+
+    def __str__(self):
+        if self.fromBook:
+            return "%s from the opening book" % self.bestMove
+        if self.fromTablebase:
+            return "%s from the endgame tablebase" % self.bestMove
+        return "%s depth %d, %d nodes (%d quiescence), %.0f nodes/sec, tt hit rate %.3f, first move cutoffs %.3f" % (
+            self.bestMove, self.depths[-1]["depth"] if self.depths else 0, self.nodes, self.qnodes, self.nps(),
+            self.ttHitRate(), self.firstMoveCutoffRate())
+
+'''
+Everything one search works with: its limits, the transposition table, the move ordering tables, the principal
+variation, the stats and the best root move so far. The search functions take it as their first argument instead of
+sharing module globals, so any number of searches can run in one process at once, in threads or side by side.
+stopCondition is an optional function the search calls every so often, it stops as soon as that returns True
 '''
-def findBestMove(gs, validMoves, returnQueue):
-    global nextMove, counter
-    nextMove = None
+class SearchContext():
+
+    def __init__(self, gs, deadline=None, nodeLimit=None, maxDepth=MAX_DEPTH, table=None, stopCondition=None, principalVariation=None,
+                 tablebase=None):
+        self.startTime = time.time()
+        self.deadline = deadline
+        self.maxNodes = nodeLimit
+        self.table = table if table is not None else transpositionTable
+        self.table.newSearch()
+        self.tablebase = tablebase if tablebase is not None else endgameTablebase
+        self.stopCondition = stopCondition
+        self.rootMoveCount = len(gs.moveLog) #the ply of a node is how many moves past this the move log is
+        self.nextMove = None #best root move of the iteration being searched
+        self.principalVariation = principalVariation if principalVariation is not None else [] #of the last finished iteration
+        self.pvTable = [] #triangular table, pvTable[ply] is the best line found from that ply on
+        self.killerMoves = [[None, None] for i in range(maxDepth + 1)]
+        self.historyTable = {color + piece: [0] * 64 for color in "wb" for piece in "pRNBQK"}
+        self.stats = SearchStats()
+
+    '''
+    Counts a node and raises SearchTimeout once the node budget is spent, the deadline passed or stopCondition says so
+    '''
+    def countNode(self):
+        stats = self.stats
+        stats.nodes += 1
+        if (self.maxNodes is not None and stats.nodes > self.maxNodes) or (stats.nodes & STOP_CHECK_MASK == 0 and self.stopped()):
+            raise SearchTimeout()
+
+    def stopped(self):
+        return (self.deadline is not None and time.time() > self.deadline) or \
+            (self.stopCondition is not None and self.stopCondition())
+
+    '''
+    Takes back the moves, null moves included, that an unfinished search left on the board
+    '''
+    def unwind(self, gs):
+        while len(gs.moveLog) > self.rootMoveCount:
+            if gs.moveLog[-1] is None:
+                gs.undoNullMove()
+            else:
+                gs.undoMove()
+
+    def finishStats(self, bestMove):
+        self.stats.seconds = time.time() - self.startTime
+        self.stats.bestMove = bestMove.getChessNotation() if bestMove is not None else None
+        return self.stats
+
+'''
+Looks the position up in the opening book (the module's book unless given another one). If it is there the book
+move is put on returnQueue and its SearchStats returned, otherwise returns None and the caller searches
+'''
+def playBookMove(gs, validMoves, returnQueue, book=None):
+    bookMove = (book if book is not None else openingBook).chooseMove(gs, validMoves)
+    if bookMove is None:
+        return None
+    stats = SearchStats()
+    stats.fromBook = True
+    stats.bestMove = bookMove.getChessNotation()
+    returnQueue.put(bookMove)
+    return stats
+
+'''
+Same for the endgame tablebase: with few enough pieces left the tables know the best move, returns None otherwise
+'''
+def playTablebaseMove(gs, validMoves, returnQueue, tablebase=None):
+    tablebaseMove = (tablebase if tablebase is not None else endgameTablebase).bestMove(gs, validMoves)
+    if tablebaseMove is None:
+        return None
+    stats = SearchStats()
+    stats.fromTablebase = True
+    stats.bestMove = tablebaseMove.getChessNotation()
+    returnQueue.put(tablebaseMove)
+    return stats
+
+'''
+Helper method to make first recursive call. Searches 1, 2, 3... plies deep until the time or node budget runs out
+and puts the best move of the deepest search that finished on returnQueue. Returns the SearchStats of the search,
+with the time spent in getValidMoves, makeMove, scoreBoard... if profile is True. Searches share the module's
+transposition table, opening book and tablebase unless given their own, and stop early once stopCondition() returns
+True. A position in the opening book or the tablebase isn't searched at all
+'''
+def findBestMove(gs, validMoves, returnQueue, timeLimit=TIME_LIMIT, nodeLimit=NODE_LIMIT, maxDepth=MAX_DEPTH, infoCallback=None,
+                 profile=False, table=None, stopCondition=None, book=None, tablebase=None):
+    stats = playBookMove(gs, validMoves, returnQueue, book) or playTablebaseMove(gs, validMoves, returnQueue, tablebase)
+    if stats is not None:
+        return stats
+    random.shuffle(validMoves)
+    startTime = time.time()
+    context = SearchContext(gs, startTime + timeLimit if timeLimit is not None else None, nodeLimit, maxDepth, table, stopCondition,
+                            tablebase=tablebase)
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    bestMove = None
+    for depth in range(1, maxDepth + 1):
+        context.pvTable = [[] for i in range(depth + 1)]
+        try:
+            #findMoveMinMax(context, gs, validMoves, DEPTH, gs.whiteToMove)
+            #findMoveNegaMax(context, gs, validMoves, DEPTH, 1 if gs.whiteToMove else -1)
+            score = findMoveNegaMaxAlphaBeta(context, gs, validMoves, depth, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
+        except SearchTimeout:
+            context.unwind(gs) #put back the moves the unfinished search was in the middle of
+            break
+        bestMove = context.nextMove
+        context.principalVariation = context.pvTable[0]
+        context.stats.addDepth(depth, score, time.time() - startTime, context.principalVariation)
+        if infoCallback is not None: #infoCallback(depth, score, nodes, seconds, pv) is told about every finished depth
+            infoCallback(depth, score, context.stats.nodes, time.time() - startTime, context.principalVariation)
+        if abs(score) >= DISTANCE_SCORE: #found a forced mate or tablebase result, searching deeper won't change it
+            break
+    if profiler is not None:
+        profiler.disable()
+        context.stats.addProfile(profiler)
+    if bestMove is None: #not even depth 1 finished, use what it found so far
+        bestMove = context.nextMove
+    returnQueue.put(bestMove)
+    return context.finishStats(bestMove)
+
+sharedAlpha = None #best root score any worker of the parallel search has finished this iteration
+sharedStop = None #set to 1 when the parallel search is asked to stop
+
+'''
+Runs once in every worker process of the parallel search's pool
+'''
+def initRootWorker(alpha, stop):
+    global sharedAlpha, sharedStop
+    sharedAlpha = alpha
+    sharedStop = stop
+
+def rootWorkerStopped():
+    return sharedStop.value != 0
+
+'''
+The worker processes of findBestMoveParallel and the values they share. Starting the processes costs more than a
+short search, and each worker keeps its transposition table from one search to the next, so a caller that searches
+again and again, like runAiWorker, makes one pool and keeps it until it is done
+'''
+class RootSearchPool():
+
+    def __init__(self, workers=PARALLEL_WORKERS):
+        self.alpha = Value('i', -CHECKMATE)
+        self.stop = Value('b', 0)
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=initRootWorker, initargs=(self.alpha, self.stop))
+
+    def submit(self, *args):
+        return self.executor.submit(searchRootMove, *args)
+
+    def close(self):
+        self.executor.shutdown()
+
+'''
+Waits for a pool task, passing a stop request from stopCondition on to the workers while it waits
+'''
+def waitForResult(future, stopCondition, stop):
+    while True:
+        try:
+            return future.result(timeout=STOP_POLL_SECONDS if stopCondition is not None else None)
+        except FutureTimeoutError:
+            if stopCondition():
+                stop.value = 1
+
+'''
+Task run by the pool workers: searches one root move depth plies deep from a PositionSnapshot of the root, which
+pickles far smaller than the GameState with its logs. The lower end of the window is the best root score any worker
+has finished so far, less one so a move that ties it still gets an exact score.
+Returns (score, windowAlpha, stats, pv), score is None if the time or node budget ran out. A score not above
+windowAlpha is only an upper bound
+'''
+def searchRootMove(gameStateClass, snapshot, moveID, depth, deadlineTime, nodeLimit, pv):
+    gs = gameStateClass.fromSnapshot(snapshot)
+    context = SearchContext(gs, deadlineTime, nodeLimit, depth, stopCondition=rootWorkerStopped, principalVariation=pv)
+    context.pvTable = [[] for i in range(depth + 1)]
+    move = ChessEngine.Move.fromMoveID(moveID, gs.board)
+    turnMultiplier = 1 if gs.whiteToMove else -1
+    alpha = sharedAlpha.value - 1
+    gs.makeMove(move)
+    try:
+        score = -findMoveNegaMaxAlphaBeta(context, gs, None, depth - 1, -CHECKMATE, -alpha, -turnMultiplier)
+    except SearchTimeout:
+        return None, alpha, context.finishStats(None), []
+    with sharedAlpha.get_lock():
+        if score > sharedAlpha.value:
+            sharedAlpha.value = score
+    return score, alpha, context.finishStats(move), [move] + context.pvTable[1]
+
+'''
+Parallel version of findBestMove: every iteration of the deepening searches the first root move on its own to get a
+bound, then hands the other root moves to a pool of worker processes, which share the best score found so far as
+their alpha. The best move is the highest exact score, ties going to the move earlier in the root order, so the result
+doesn't depend on which worker finished first. Searches on the given RootSearchPool, or on one made for this search
+only. Returns the SearchStats of all the workers added up
+'''
+def findBestMoveParallel(gs, validMoves, returnQueue, workers=PARALLEL_WORKERS, timeLimit=TIME_LIMIT, nodeLimit=NODE_LIMIT, maxDepth=MAX_DEPTH,
+                         infoCallback=None, stopCondition=None, book=None, tablebase=None, pool=None):
+    stats = playBookMove(gs, validMoves, returnQueue, book) or playTablebaseMove(gs, validMoves, returnQueue, tablebase)
+    if stats is not None:
+        return stats
+    if pool is not None:
+        return searchParallel(gs, validMoves, returnQueue, pool, timeLimit, nodeLimit, maxDepth, infoCallback, stopCondition)
+    pool = RootSearchPool(workers)
+    try:
+        return searchParallel(gs, validMoves, returnQueue, pool, timeLimit, nodeLimit, maxDepth, infoCallback, stopCondition)
+    finally:
+        pool.close()
+
+def searchParallel(gs, validMoves, returnQueue, pool, timeLimit, nodeLimit, maxDepth, infoCallback, stopCondition):
     random.shuffle(validMoves)
-    counter = 0
-    #findMoveMinMax(gs, validMoves, DEPTH, gs.whiteToMove)
-    #findMoveNegaMax(gs, validMoves, DEPTH, 1 if gs.whiteToMove else -1)
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    print(counter)
-    returnQueue.put(nextMove)
-
-def findMoveMinMax(gs, validMoves, depth, whiteToMove):
-    global nextMove
+    startTime = time.time()
+    deadlineTime = startTime + timeLimit if timeLimit is not None else None
+    stats = SearchStats()
+    movesByID = {move.moveID: move for move in validMoves}
+    rootMoveIDs = list(movesByID)
+    gameStateClass, snapshot = type(gs), gs.snapshot()
+    pool.stop.value = 0
+    bestMove = None
+    pv = []
+    for depth in range(1, maxDepth + 1):
+        if len(rootMoveIDs) == 0 or (nodeLimit is not None and stats.nodes >= nodeLimit):
+            break
+        #the node budget left is shared out so all the tasks together stay within it: until a first move has finished
+        #depth 1 the first move may use all of it, after that it gets half, searched with the full window, and the
+        #others equal shares of the rest
+        if nodeLimit is None:
+            nodeBudget = None
+        elif bestMove is None or len(rootMoveIDs) == 1:
+            nodeBudget = nodeLimit - stats.nodes
+        else:
+            nodeBudget = max(1, (nodeLimit - stats.nodes) // 2)
+        pool.alpha.value = -CHECKMATE
+        firstMove = pool.submit(gameStateClass, snapshot, rootMoveIDs[0], depth, deadlineTime, nodeBudget, pv)
+        results = [waitForResult(firstMove, stopCondition, pool.stop)]
+        finished = results[0][0] is not None
+        if finished and len(rootMoveIDs) > 1:
+            if nodeLimit is not None:
+                nodeBudget = max(1, (nodeLimit - stats.nodes - results[0][2].nodes) // (len(rootMoveIDs) - 1))
+            futures = [pool.submit(gameStateClass, snapshot, moveID, depth, deadlineTime, nodeBudget, pv)
+                       for moveID in rootMoveIDs[1:]]
+            for i, future in enumerate(futures):
+                results.append(waitForResult(future, stopCondition, pool.stop))
+                if results[-1][0] is None: #out of time, the moves not searched yet are left out of this iteration
+                    finished = False
+                    for unstarted in futures[i + 1:]:
+                        unstarted.cancel()
+                    break
+            if not finished: #let the tasks already running see the stop and finish before the next search
+                pool.stop.value = 1
+                for future in futures:
+                    if not future.cancelled():
+                        future.exception()
+        for result in results:
+            stats.merge(result[2])
+        best = None
+        for i, (score, windowAlpha, taskStats, line) in enumerate(results):
+            if score is not None and score > windowAlpha and (best is None or score > results[best][0]):
+                best = i
+        if best is None: #the first move didn't finish, the last iteration's move stands
+            break
+        #a move that finished this depth is kept even if the iteration didn't, it was searched deeper than the last
+        score, pv = results[best][0], results[best][3]
+        bestMove = movesByID[rootMoveIDs[best]]
+        rootMoveIDs.insert(0, rootMoveIDs.pop(best)) #search the best move first next iteration
+        if not finished:
+            break
+        stats.addDepth(depth, score, time.time() - startTime, pv)
+        if infoCallback is not None:
+            infoCallback(depth, score, stats.nodes, time.time() - startTime, pv)
+        if abs(score) >= DISTANCE_SCORE:
+            break
+    if bestMove is None and len(rootMoveIDs) > 0: #not even depth 1 finished, play the first move rather than none
+        bestMove = movesByID[rootMoveIDs[0]]
+    stats.seconds = time.time() - startTime
+    stats.bestMove = bestMove.getChessNotation() if bestMove is not None else None
+    returnQueue.put(bestMove)
+    return stats
+
+'''
+Loop run by the AiWorker process. Keeps its own GameState in step with the game through small messages and answers
+every "go" with ("bestmove", searchID, moveID, stats). The transposition table lives as long as the process, so what one
+move's search stored is still there for the next. With more than one worker the RootSearchPool does too
+    ("new",)                                   start a new game
+    ("fen", fen)                               start a new game from a FEN position
+    ("move", moveID)                           make a move
+    ("undo",)                                  take back the last move
+    ("go", searchID, timeLimit, nodeLimit)     search the current position
+    ("quit",)                                  stop the process
+'''
+def runAiWorker(connection, cancelled, gameStateClass, workers):
+    gs = gameStateClass()
+    pool = RootSearchPool(workers) if workers > 1 else None
+    searchID = 0
+    def searchCancelled():
+        return cancelled.value >= searchID
+    while True:
+        message = connection.recv()
+        command = message[0]
+        if command == "move":
+            gs.makeMove(ChessEngine.Move.fromMoveID(message[1], gs.board))
+        elif command == "undo":
+            gs.undoMove()
+        elif command == "new":
+            gs = gameStateClass()
+        elif command == "fen":
+            gs = gameStateClass.fromFEN(message[1])
+        elif command == "go":
+            searchID, timeLimit, nodeLimit = message[1:]
+            returnQueue = queue.Queue()
+            if searchCancelled(): #stopped before it started
+                returnQueue.put(None)
+                stats = SearchStats()
+            elif pool is not None:
+                stats = findBestMoveParallel(gs, gs.getValidMoves(), returnQueue, workers, timeLimit, nodeLimit, stopCondition=searchCancelled,
+                                             pool=pool)
+            else:
+                stats = findBestMove(gs, gs.getValidMoves(), returnQueue, timeLimit, nodeLimit, stopCondition=searchCancelled)
+            bestMove = returnQueue.get()
+            connection.send(("bestmove", searchID, bestMove.moveID if bestMove is not None else None, stats))
+        elif command == "quit":
+            break
+    if pool is not None:
+        pool.close()
+    connection.close()
+
+'''
+Long lived AI process. Instead of pickling the whole GameState for every search it is sent the moves made since the
+last search, so the cost of a search request doesn't grow with the length of the game. A search is cancelled through
+a shared value the search checks as it runs, so the process never has to be terminated
+'''
+class AiWorker():
+
+    def __init__(self, gameStateClass=ChessEngine.GameState, workers=1):
+        self.connection, workerConnection = Pipe()
+        self.cancelled = Value('i', 0, lock=False)
+        self.process = Process(target=runAiWorker, args=(workerConnection, self.cancelled, gameStateClass, workers))
+        self.process.start()
+        self.startFEN = None #position the worker's game started from, None for the normal start
+        self.moveIDs = [] #moves the worker's GameState has made
+        self.searchID = 0
+        self.thinking = False
+        self.bestMoveID = None
+        self.lastStats = None #SearchStats of the last search that finished
+
+    '''
+    Sends the undo and move messages that bring the worker's GameState to the position of gs
+    '''
+    def sync(self, gs):
+        moveIDs = [move.moveID for move in gs.moveLog]
+        common = 0
+        while common < len(self.moveIDs) and common < len(moveIDs) and self.moveIDs[common] == moveIDs[common]:
+            common += 1
+        if gs.startFEN != self.startFEN: #a different game, start over from its first position
+            self.connection.send(("new",) if gs.startFEN is None else ("fen", gs.startFEN))
+            self.startFEN = gs.startFEN
+            common = 0
+        elif common == 0 and len(self.moveIDs) > 0: #back at the first position, set it up again instead of undoing
+            self.connection.send(("new",) if self.startFEN is None else ("fen", self.startFEN))
+        else:
+            for i in range(len(self.moveIDs) - common):
+                self.connection.send(("undo",))
+        for moveID in moveIDs[common:]:
+            self.connection.send(("move", moveID))
+        self.moveIDs = moveIDs
+
+    '''
+    Starts searching the position of gs, poll() says when the move is ready
+    '''
+    def go(self, gs, timeLimit=TIME_LIMIT, nodeLimit=NODE_LIMIT):
+        self.sync(gs)
+        self.searchID += 1
+        self.thinking = True
+        self.bestMoveID = None
+        self.lastStats = None
+        self.connection.send(("go", self.searchID, timeLimit, nodeLimit))
+
+    '''
+    Returns True once the search started by go() has finished. Answers to cancelled searches are thrown away
+    '''
+    def poll(self):
+        while self.thinking and self.connection.poll():
+            reply, searchID, moveID, stats = self.connection.recv()
+            if searchID == self.searchID:
+                self.bestMoveID = moveID
+                self.lastStats = stats
+                self.thinking = False
+        return not self.thinking
+
+    '''
+    The move the last search found as a Move on the board of gs, None if it found none
+    '''
+    def getMove(self, gs):
+        if self.bestMoveID is None:
+            return None
+        return ChessEngine.Move.fromMoveID(self.bestMoveID, gs.board)
+
+    '''
+    Asks the running search to stop, its answer will be ignored
+    '''
+    def stop(self):
+        if self.thinking:
+            self.cancelled.value = self.searchID
+            self.thinking = False
+
+    def quit(self):
+        self.stop()
+        self.connection.send(("quit",))
+        self.process.join()
+
+#move ordering
+MVV_LVA_VALUES = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 20} #the king attacks last
+PV_MOVE_SCORE = 4000000
+HASH_MOVE_SCORE = 3000000
+CAPTURE_SCORE = 2000000
+KILLER_SCORES = (1000000, 900000)
+DELTA_MARGIN = 200 #centipawns, a capture is skipped in quiescence if even winning the piece plus this much can't raise alpha
+
+#selective search, each part can be switched off
+NULL_MOVE_PRUNING = True #let the opponent move twice, a position still good enough for a cutoff isn't searched
+NULL_MOVE_REDUCTION = 2 #plies the null move is searched shallower, on top of the ply it uses
+NULL_MOVE_MIN_MATERIAL = 4 #pawn units of pieces besides pawns and king the side to move needs, zugzwang is likely below
+LATE_MOVE_REDUCTIONS = True #search quiet moves ordered late one or two plies shallower, again at full depth if they surprise
+LMR_FULL_DEPTH_MOVES = 3 #moves searched at full depth before the reductions start
+LMR_DEEP_MOVES = 8 #moves from this one on are reduced by two plies
+LMR_MIN_DEPTH = 3
+PRINCIPAL_VARIATION_SEARCH = True #moves after the first get a zero window, only one that beats alpha is searched again
+
+'''
+Returns the moveID the previous iteration's principal variation plays at this node, or None if the node is not on it
+'''
+def principalVariationMoveID(context, gs, ply):
+    principalVariation = context.principalVariation
+    if ply >= len(principalVariation):
+        return None
+    for i in range(ply):
+        if gs.moveLog[context.rootMoveCount + i] != principalVariation[i]:
+            return None
+    return principalVariation[ply].moveID
+
+'''
+MVV-LVA score of a capture or promotion, 0 for a quiet move
+'''
+def captureOrderScore(move):
+    if move.isCapture:
+        return CAPTURE_SCORE + MVV_LVA_VALUES[move.pieceCaptured[1]] * 100 - MVV_LVA_VALUES[move.pieceMoved[1]]
+    if move.isPawnPromotion:
+        return CAPTURE_SCORE + MVV_LVA_VALUES[move.promotionPiece] * 100
+    return 0
+
+'''
+Sorts the moves best first: principal variation move, hash move, captures by most valuable victim / least valuable
+attacker, killer moves of this ply, then quiet moves by their history score
+'''
+def orderMoves(context, gs, validMoves, ply, hashMoveID):
+    pvMoveID = principalVariationMoveID(context, gs, ply)
+    killers = context.killerMoves[ply]
+    historyTable = context.historyTable
+    def moveOrderScore(move):
+        if move.moveID == pvMoveID:
+            return PV_MOVE_SCORE
+        if move.moveID == hashMoveID:
+            return HASH_MOVE_SCORE
+        if move.isCapture or move.isPawnPromotion:
+            return captureOrderScore(move)
+        if move.moveID == killers[0]:
+            return KILLER_SCORES[0]
+        if move.moveID == killers[1]:
+            return KILLER_SCORES[1]
+        return historyTable[move.pieceMoved][move.endRow * 8 + move.endCol]
+    validMoves.sort(key=moveOrderScore, reverse=True)
+
+'''
+Remembers a quiet move that caused a beta cutoff, as a killer for this ply and in the history table
+'''
+def recordCutoff(context, move, depth, ply):
+    if move.isCapture or move.isPawnPromotion:
+        return
+    killers = context.killerMoves[ply]
+    if killers[0] != move.moveID:
+        killers[1] = killers[0]
+        killers[0] = move.moveID
+    context.historyTable[move.pieceMoved][move.endRow * 8 + move.endCol] += depth * depth
+
+def findMoveMinMax(context, gs, validMoves, depth, whiteToMove):
     if depth == 0:
         return scoreMaterial(gs.board)
 
@@ -149,11 +834,11 @@ def findMoveMinMax(gs, validMoves, depth, whiteToMove):
         for move in validMoves:
             gs.makeMove(move)
             nextMoves = gs.getValidMoves()
-            score = findMoveMinMax(gs, nextMoves, depth -1, False)
+            score = findMoveMinMax(context, gs, nextMoves, depth -1, False)
             if score > maxScore:
                 maxScore = score
-                if depth == DEPTH:
-                    nextMove = move
+                if len(gs.moveLog) == context.rootMoveCount + 1: #a root move
+                    context.nextMove = move
             gs.undoMove()
         return maxScore
 
@@ -162,17 +847,16 @@ def findMoveMinMax(gs, validMoves, depth, whiteToMove):
         for move in validMoves:
             gs.makeMove(move)
             nextMoves = gs.getValidMoves()
-            score = findMoveMinMax(gs, nextMoves, depth -1, True)
+            score = findMoveMinMax(context, gs, nextMoves, depth -1, True)
             if score < minScore:
                 minScore = score
-                if depth == DEPTH:
-                    nextMove = move
+                if len(gs.moveLog) == context.rootMoveCount + 1: #a root move
+                    context.nextMove = move
             gs.undoMove()
         return minScore
 
-def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
-    global nextMove, counter
-    counter += 1
+def findMoveNegaMax(context, gs, validMoves, depth, turnMultiplier):
+    context.stats.nodes += 1
     if depth == 0:
         return turnMultiplier * scoreBoard(gs)
     
@@ -180,39 +864,184 @@ def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
     for move in validMoves:
         gs.makeMove(move)
         nextMoves= gs.getValidMoves()
-        score = -findMoveNegaMax(gs, nextMoves, depth-1, -turnMultiplier)
+        score = -findMoveNegaMax(context, gs, nextMoves, depth-1, -turnMultiplier)
         if score > maxScore:
             maxScore = score
-            if depth == DEPTH:
-                nextMove = move
+            if len(gs.moveLog) == context.rootMoveCount + 1: #a root move
+                context.nextMove = move
         gs.undoMove()
     return maxScore
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove, counter
-    counter += 1
-    if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
-    
-    #move ordering - implement later
+def findMoveNegaMaxAlphaBeta(context, gs, validMoves, depth, alpha, beta, turnMultiplier):
+    context.countNode()
+    ply = len(gs.moveLog) - context.rootMoveCount
+    context.pvTable[ply] = []
+
+    #look the position up in the transposition table before generating moves, the root always searches so nextMove gets set
+    alphaOriginal = alpha
+    entry = context.table.probe(gs.zobristKey)
+    context.stats.ttProbes += 1
+    if entry is not None:
+        context.stats.ttHits += 1
+    if entry is not None and entry[1] >= depth and ply != 0:
+        bound, ttScore = entry[2], scoreFromTable(entry[3], ply)
+        if bound == EXACT:
+            return ttScore
+        elif bound == LOWERBOUND:
+            alpha = max(alpha, ttScore)
+        elif bound == UPPERBOUND:
+            beta = min(beta, ttScore)
+        if alpha >= beta:
+            return ttScore
+
+    #right after a capture or pawn move a small enough position is looked up in the tablebase instead of searched
+    if gs.halfmoveClock == 0 and ply != 0 and context.tablebase.covers(gs):
+        wdl = context.tablebase.probeWDL(gs)
+        if wdl is not None:
+            context.stats.tablebaseHits += 1
+            if wdl == ChessTablebase.WIN:
+                score = TABLEBASE_WIN - ply #the shorter way to the tablebase win scores higher
+            elif wdl == ChessTablebase.LOSS:
+                score = -TABLEBASE_WIN + ply
+            else: #cursed wins and blessed losses are drawn by the fifty move rule
+                score = 0
+            context.table.store(gs.zobristKey, depth, EXACT, scoreToTable(score, ply), None)
+            return score
+
+    if depth == 0: #settle the captures before scoring the position
+        maxScore = quiescenceSearch(context, gs, alpha, beta, turnMultiplier)
+        bestMove = None
+    else:
+        if validMoves is None: #children get their moves generated here, only once the table can't answer for them
+            validMoves = gs.getValidMoves()
+        if len(validMoves) == 0: #checkmate or stalemate
+            return -CHECKMATE + ply if gs.checkMate else STALEMATE
+        if nullMoveCutoff(context, gs, depth, beta, turnMultiplier, ply):
+            context.stats.nullMoveCutoffs += 1
+            maxScore, bestMove = beta, None
+        else:
+            maxScore, bestMove = searchMoves(context, gs, validMoves, depth, alpha, beta, turnMultiplier, ply, entry)
+
+    if maxScore <= alphaOriginal:
+        bound = UPPERBOUND
+    elif maxScore >= beta:
+        bound = LOWERBOUND
+    else:
+        bound = EXACT
+    context.table.store(gs.zobristKey, depth, bound, scoreToTable(maxScore, ply), bestMove)
+    return maxScore
+
+'''
+Null move pruning: the side to move passes and the opponent's reply is searched shallower with a zero window at beta.
+If passing still scores at least beta, a real move would too, so the node is cut without searching its moves. Not
+tried at the root, in check, right after another null move, when beta is a mate score, or when the side to move is
+down to pawns and few pieces, where passing may really be its best option (zugzwang)
+'''
+def nullMoveCutoff(context, gs, depth, beta, turnMultiplier, ply):
+    if not NULL_MOVE_PRUNING or ply == 0 or depth <= NULL_MOVE_REDUCTION or gs.inCheck or gs.moveLog[-1] is None or \
+            abs(beta) >= DISTANCE_SCORE or \
+            gs.nonPawnMaterial['w' if gs.whiteToMove else 'b'] < NULL_MOVE_MIN_MATERIAL * CENTIPAWNS_PER_PAWN:
+        return False
+    gs.makeNullMove()
+    score = -findMoveNegaMaxAlphaBeta(context, gs, None, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1, -turnMultiplier)
+    gs.undoNullMove()
+    return score >= beta
+
+'''
+Plies the late move reductions take off a move: none for the first few moves, captures, promotions, killers, in check
+or near the leaves, one for the rest and two for the moves ordered last
+'''
+def lateMoveReduction(context, move, i, depth, ply, inCheck):
+    if not LATE_MOVE_REDUCTIONS or i < LMR_FULL_DEPTH_MOVES or depth < LMR_MIN_DEPTH or inCheck or move.isCapture or \
+            move.isPawnPromotion or move.moveID in context.killerMoves[ply]:
+        return 0
+    return 2 if i >= LMR_DEEP_MOVES and depth > 3 else 1
+
+'''
+Searches the moves of a node in order, returns the best score and the move that got it. With principal variation
+search only the first move gets the full window, the rest are only tested against alpha with a zero window and get
+a full search if one beats it. Late quiet moves are searched shallower first, and again at full depth if they beat alpha
+'''
+def searchMoves(context, gs, validMoves, depth, alpha, beta, turnMultiplier, ply, entry):
+    orderMoves(context, gs, validMoves, ply, entry[4] if entry is not None else None)
+    pvTable = context.pvTable
+    inCheck = gs.inCheck #the children's move generation overwrites it
     maxScore = -CHECKMATE
-    for move in validMoves:
+    bestMove = None
+    for i, move in enumerate(validMoves):
         gs.makeMove(move)
-        nextMoves= gs.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth-1, -beta, -alpha, -turnMultiplier)
+        if i == 0:
+            score = -findMoveNegaMaxAlphaBeta(context, gs, None, depth-1, -beta, -alpha, -turnMultiplier)
+        else:
+            reduction = lateMoveReduction(context, move, i, depth, ply, inCheck)
+            windowBeta = alpha + 1 if PRINCIPAL_VARIATION_SEARCH else beta
+            score = -findMoveNegaMaxAlphaBeta(context, gs, None, depth-1-reduction, -windowBeta, -alpha, -turnMultiplier)
+            if reduction > 0:
+                context.stats.reducedMoves += 1
+                if score > alpha: #the reduced search says the move may be good after all
+                    context.stats.researches += 1
+                    score = -findMoveNegaMaxAlphaBeta(context, gs, None, depth-1, -windowBeta, -alpha, -turnMultiplier)
+            if windowBeta < beta and alpha < score < beta: #beat alpha on the zero window, get its real score
+                context.stats.researches += 1
+                score = -findMoveNegaMaxAlphaBeta(context, gs, None, depth-1, -beta, -alpha, -turnMultiplier)
         if score > maxScore:
             maxScore = score
-            if depth == DEPTH:
-                nextMove = move
-                print(move, score)
+            bestMove = move
+            if ply == 0:
+                context.nextMove = move
         gs.undoMove()
         if maxScore > alpha: #pruning happens
             alpha = maxScore
+            pvTable[ply] = [move] + pvTable[ply + 1]
         if alpha >= beta:
+            recordCutoff(context, move, depth, ply)
+            context.stats.betaCutoffs += 1
+            if i == 0:
+                context.stats.firstMoveCutoffs += 1
             break
+
+    return maxScore, bestMove
+
+'''
+Searches captures only until the position is quiet, so a leaf is never scored with a piece hanging. The side to move
+can always stand pat on the static score instead of capturing, and captures that can't bring the score back up to
+alpha even if the captured piece comes for free are skipped (delta pruning). When in check every evasion is searched
+'''
+def quiescenceSearch(context, gs, alpha, beta, turnMultiplier):
+    context.countNode()
+    context.stats.qnodes += 1
+    moves = gs.getValidCaptures()
+    if gs.inCheck:
+        if len(moves) == 0: #checkmate
+            return -CHECKMATE + len(gs.moveLog) - context.rootMoveCount
+        maxScore = -CHECKMATE
+        standPat = None
+    else:
+        standPat = turnMultiplier * scoreBoard(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        maxScore = standPat
+    moves.sort(key=captureOrderScore, reverse=True)
+    for move in moves:
+        if standPat is not None and not move.isPawnPromotion and \
+                standPat + pieceScore[move.pieceCaptured[1]] * CENTIPAWNS_PER_PAWN + DELTA_MARGIN < alpha:
+            continue
+        gs.makeMove(move)
+        score = -quiescenceSearch(context, gs, -beta, -alpha, -turnMultiplier)
+        gs.undoMove()
+        if score > maxScore:
+            maxScore = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
     return maxScore
+
 '''
-A postive score is good for white, a negative score is good for black
+A postive score is good for white, a negative score is good for black. In centipawns, read from the running
+material and positional score the GameState keeps, so it doesn't have to look at the board
 '''
 def scoreBoard(gs):
     if gs.checkMate:
@@ -223,31 +1052,7 @@ def scoreBoard(gs):
     elif gs.staleMate:
         return STALEMATE
 
-    score = 0
-    for row in range (len(gs.board)):
-        for col in range(len(gs.board[row])):
-            square = gs.board[row][col]
-            if square != "--":
-                #score it positionally
-                piecePositionScore = 0
-                if square[1] == "p":
-                    piecePositionScore = piecePositionScores[square][row][col]
-                elif square[1] == "K":
-                    piecePositionScore = piecePositionScores[square][row][col]
-                else:
-                    piecePositionScore = piecePositionScores[square[1]][row][col]
-
-                if square[0] == 'w':
-                    score += pieceScore[square[1]] + piecePositionScore * .1
-                elif square[0] == 'b':
-                    score -= pieceScore[square[1]] + piecePositionScore * .1
-    
-    return score
-
-
-
-
-
+    return gs.materialScore + gs.positionScore
 
 '''
 Score the board based on material.
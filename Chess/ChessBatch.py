@@ -0,0 +1,176 @@
+"""
+Headless batch runner for testing engine changes. Plays self-play games, or analyses every position of a FEN file,
+across a pool of processes. Each finished game or position is written as one JSON line with per-move time, nodes,
+depth and score, and games are also appended to a PGN file. Running the same command again skips what the output
+file already holds and writes the PGN file again from it, so an interrupted run picks up where it stopped.
+
+Usage: python ChessBatch.py --games N [--output games.jsonl] [--pgn games.pgn]
+       python ChessBatch.py --fens positions.fen [--output analysis.jsonl]
+       common options: [--workers N] [--movetime S] [--nodes N] [--depth N]
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import ChessEngine, ChessAi, ChessBook, ChessPgn
+
+DEFAULT_MOVE_TIME = 0.5 #seconds per move
+MAX_PLIES = 300 #a game still going after this many plies is scored a draw
+RANDOM_PLIES = 2 #random opening plies at the start of each game so the games differ
+REPETITIONS = 3
+FIFTY_MOVE_PLIES = 100
+PLAYER_NAME = "PlayableChess_AI"
+
+'''
+Runs findBestMove on gs, which plays from the opening book while it can, and returns (move, record) where record holds the move and what the search reported for it
+'''
+def searchMove(gs, options, book=None):
+    returnQueue = queue.Queue()
+    validMoves = gs.getValidMoves()
+    stats = ChessAi.findBestMove(gs, validMoves, returnQueue, options["movetime"], options["nodes"], options["depth"], book=book)
+    move = returnQueue.get()
+    if move is None:
+        move = validMoves[0]
+    lastDepth = stats.depths[-1] if stats.depths else {"depth": 0, "score": None}
+    record = {"move": move.getChessNotation(), "time": round(stats.seconds, 4), "nodes": stats.nodes,
+              "qnodes": stats.qnodes, "depth": lastDepth["depth"], "score": lastDepth["score"], "nps": round(stats.nps()),
+              "ttHitRate": round(stats.ttHitRate(), 4), "firstMoveCutoffRate": round(stats.firstMoveCutoffRate(), 4),
+              "book": stats.fromBook}
+    return move, record
+
+'''
+Returns (result, termination) if the game is over, None if it goes on. Checkmate and stalemate flags come from the
+getValidMoves call the caller just made
+'''
+def gameOver(gs, plies):
+    if gs.checkMate:
+        return ("0-1" if gs.whiteToMove else "1-0"), "checkmate"
+    if gs.staleMate:
+        return "1/2-1/2", "stalemate"
+    if gs.halfmoveClock >= FIFTY_MOVE_PLIES:
+        return "1/2-1/2", "fifty moves"
+    if gs.repetitions() >= REPETITIONS:
+        return "1/2-1/2", "repetition"
+    if plies >= MAX_PLIES:
+        return "1/2-1/2", "move limit"
+    return None
+
+'''
+PGN text of a finished game, with its moves in SAN
+'''
+def gamePgn(gameIndex, gs, result):
+    headers = [("Event", "ChessBatch self-play"), ("Round", str(gameIndex + 1)), ("White", PLAYER_NAME),
+               ("Black", PLAYER_NAME)]
+    return ChessPgn.gamePgn(gs, result, headers)
+
+'''
+Plays one self-play game, run in a worker process. The opening plies are random, seeded by the game number so a
+resumed run replays the same openings
+'''
+def playGame(gameIndex, options):
+    random.seed(gameIndex)
+    gs = ChessEngine.GameState()
+    ChessAi.transpositionTable.clear()
+    records = []
+    while True:
+        validMoves = gs.getValidMoves()
+        over = gameOver(gs, len(gs.moveLog))
+        if over is not None:
+            break
+        if len(gs.moveLog) < options["randomPlies"]:
+            move = ChessAi.findRandomMove(validMoves)
+            record = {"move": move.getChessNotation(), "time": 0, "nodes": 0, "depth": 0, "score": None}
+        else:
+            move, record = searchMove(gs, options)
+        gs.makeMove(move)
+        records.append(record)
+    result, termination = over
+    return {"game": gameIndex, "result": result, "termination": termination, "plies": len(gs.moveLog),
+            "moves": records, "pgn": gamePgn(gameIndex, gs, result)}
+
+'''
+Searches one FEN position, run in a worker process. The opening book is left out, analysis always searches
+'''
+def analysePosition(positionIndex, fen, options):
+    gs = ChessEngine.GameState.fromFEN(fen)
+    if len(gs.getValidMoves()) == 0:
+        return {"position": positionIndex, "fen": fen, "move": None, "checkmate": gs.checkMate, "stalemate": gs.staleMate}
+    move, record = searchMove(gs, options, ChessBook.OpeningBook(None))
+    record.update(position=positionIndex, fen=fen)
+    return record
+
+'''
+Reads the JSON lines already written to path and returns them as a dict by the value of the given key, so those jobs
+can be skipped. A last line cut off by an interrupted run is ended so new lines don't get appended to it
+'''
+def finishedJobs(path, key):
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as file:
+        text = file.read()
+    for line in text.splitlines():
+        try:
+            record = json.loads(line)
+            done[record[key]] = record
+        except (ValueError, KeyError): #a line cut off when the run was interrupted
+            continue
+    if text and not text.endswith("\n"):
+        with open(path, "a") as file:
+            file.write("\n")
+    return done
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless self-play and position analysis")
+    parser.add_argument("--games", type=int, help="number of self-play games to play")
+    parser.add_argument("--fens", help="file with one FEN position per line to analyse instead")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--movetime", type=float, default=DEFAULT_MOVE_TIME, help="seconds per move")
+    parser.add_argument("--nodes", type=int, help="node limit per move")
+    parser.add_argument("--depth", type=int, default=ChessAi.MAX_DEPTH, help="depth limit per move")
+    parser.add_argument("--random-plies", type=int, default=RANDOM_PLIES)
+    parser.add_argument("--output", help="JSON lines output, default games.jsonl or analysis.jsonl")
+    parser.add_argument("--pgn", default="games.pgn", help="PGN output for self-play games")
+    args = parser.parse_args()
+    if (args.games is None) == (args.fens is None):
+        parser.error("give either --games or --fens")
+    options = {"movetime": args.movetime, "nodes": args.nodes, "depth": args.depth, "randomPlies": args.random_plies}
+    output = args.output or ("games.jsonl" if args.games is not None else "analysis.jsonl")
+    startTime = time.time()
+    finished = 0
+    #read what is done before the output is opened to append to
+    done = finishedJobs(output, "game" if args.games is not None else "position")
+    with ProcessPoolExecutor(max_workers=args.workers) as pool, open(output, "a") as outputFile:
+        if args.games is not None:
+            futures = [pool.submit(playGame, i, options) for i in range(args.games) if i not in done]
+            #the JSON lines are what a resumed run goes by, so the PGN is written again from them: a game an
+            #interrupted run got into the JSON lines but not the PGN isn't lost, and none is there twice
+            pgnFile = open(args.pgn, "w")
+            for record in done.values():
+                pgnFile.write(record["pgn"])
+            pgnFile.flush()
+        else:
+            with open(args.fens) as fenFile:
+                fens = [line.strip() for line in fenFile if line.strip()]
+            futures = [pool.submit(analysePosition, i, fen, options) for i, fen in enumerate(fens) if i not in done]
+            pgnFile = None
+        print("%d already done, %d to run" % (len(done), len(futures)))
+        for future in as_completed(futures):
+            result = future.result()
+            outputFile.write(json.dumps(result) + "\n")
+            outputFile.flush() #every finished job is on disk before the next one, for resuming
+            if pgnFile is not None:
+                pgnFile.write(result["pgn"])
+                pgnFile.flush()
+            finished += 1
+            print("%d/%d done, %.1fs" % (finished, len(futures), time.time() - startTime))
+        if pgnFile is not None:
+            pgnFile.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Regression checks for the parts of the engine perft doesn't reach. Each check sets up a position or a game, runs the
+code on it and compares what comes out with what should, printing ok or FAIL with the reason.
+
+Usage: python ChessChecks.py [--check NAME]
+"""
+import argparse
+import queue
+import sys
+import time
+import types
+import ChessEngine, ChessAi, ChessTablebase
+
+CHECK_MOVE_TIME = 0.2 #seconds per search in the checks
+WORKER_TIMEOUT = 30 #seconds a check waits for the AiWorker before giving up
+
+'''
+Runs a search on the AiWorker and returns its move on the board of gs, or None if it didn't answer in time
+'''
+def workerMove(worker, gs):
+    worker.go(gs, CHECK_MOVE_TIME)
+    waitUntil = time.time() + WORKER_TIMEOUT
+    while not worker.poll():
+        if time.time() > waitUntil:
+            return None
+        time.sleep(0.01)
+    return worker.getMove(gs)
+
+'''
+Plays a game started from a FEN against an AiWorker, takes every move back to the first position and searches again.
+The worker has to be put back on the FEN position, not the normal start, or its move makes no sense on the game's board.
+The FEN has nothing on the squares white's first moves in the normal start come from, so such a move can't pass
+'''
+def checkWorkerSync():
+    gs = ChessEngine.GameState.fromFEN("r3k2r/pppppppp/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    worker = ChessAi.AiWorker()
+    try:
+        for i in range(3):
+            move = workerMove(worker, gs)
+            if move is None or move not in gs.getValidMoves():
+                return False, "no legal move after %d moves" % i
+            gs.makeMove(move)
+        while gs.moveLog:
+            gs.undoMove()
+        move = workerMove(worker, gs)
+        if move is None or move not in gs.getValidMoves():
+            return False, "no legal move after undoing to the FEN position"
+        if move.pieceMoved[0] != 'w':
+            return False, "worker moved " + move.pieceMoved
+    finally:
+        worker.quit()
+    return True, ""
+
+'''
+Positions with a forced mate, the depth to search them to and the mate in full moves for the side to move, negative
+when it gets mated
+'''
+MATE_POSITIONS = [
+    ("7k/8/6K1/8/8/8/8/R7 b - - 0 1", 4, -1),
+    ("6k1/8/6K1/8/8/8/8/R7 w - - 0 1", 4, 1),
+    ("3k4/8/4Q3/2K5/8/8/8/8 w - - 0 1", 9, 3),
+]
+
+'''
+The search scores a mate CHECKMATE minus the plies to it, so the distance can be read back from the score, and the
+side getting mated still gets a move to play
+'''
+def checkMateScores():
+    for fen, depth, mateMoves in MATE_POSITIONS:
+        gs = ChessEngine.GameState.fromFEN(fen)
+        returnQueue = queue.Queue()
+        ChessAi.transpositionTable.clear()
+        stats = ChessAi.findBestMove(gs, gs.getValidMoves(), returnQueue, None, None, depth)
+        move = returnQueue.get()
+        score = stats.depths[-1]["score"]
+        plies = ChessAi.CHECKMATE - abs(score)
+        if move is None:
+            return False, "no move in " + fen
+        if (score > 0) != (mateMoves > 0) or (plies + 1) // 2 != abs(mateMoves):
+            return False, "score %d in %s, expected mate in %d" % (score, fen, mateMoves)
+    return True, ""
+
+'''
+Budgets too small for the parallel search to finish depth 1 on a position with lots of captures, it still has to
+play a legal move, the one it had looked at first if nothing better finished
+'''
+def checkParallelFallback():
+    gs = ChessEngine.GameState.fromFEN("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+    pool = ChessAi.RootSearchPool(2)
+    try:
+        for timeLimit, nodeLimit in [(0.05, None), (None, 300), (None, 3000)]:
+            returnQueue = queue.Queue()
+            ChessAi.transpositionTable.clear()
+            ChessAi.findBestMoveParallel(gs, gs.getValidMoves(), returnQueue, timeLimit=timeLimit, nodeLimit=nodeLimit,
+                                         pool=pool)
+            move = returnQueue.get()
+            if move is None or move not in gs.getValidMoves():
+                return False, "no legal move with time limit %s, node limit %s" % (timeLimit, nodeLimit)
+    finally:
+        pool.close()
+        ChessAi.transpositionTable.clear()
+    return True, ""
+
+'''
+FEN setup: a side to move other than w or b is refused, and castling rights whose king or rook isn't on its starting
+square are dropped before the hash is made, so no castle move can take a rook that isn't there
+'''
+def checkFEN():
+    try:
+        ChessEngine.GameState.fromFEN("4k3/8/8/8/8/8/8/4K3 x - - 0 1")
+        return False, "side to move x taken"
+    except ValueError:
+        pass
+    for fen, castling in [("r3k3/8/8/8/8/8/8/4K2R w KQkq - 0 1", "Kq"),
+                          ("4k2r/8/8/8/8/8/8/R2K3R w KQkq - 0 1", "k"),
+                          ("r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1", "KQkq")]:
+        gs = ChessEngine.GameState.fromFEN(fen)
+        if gs.toFEN().split()[2] != castling:
+            return False, "castling %s in %s, expected %s" % (gs.toFEN().split()[2], fen, castling)
+        if gs.zobristKey != gs.computeZobristKey():
+            return False, "zobrist key differs from the board's in " + fen
+        for move in gs.getValidMoves():
+            if move.castle:
+                gs.makeMove(move)
+                if gs.zobristKey != gs.computeZobristKey() or gs.board[move.endRow].count(move.pieceMoved[0] + 'R') == 0:
+                    return False, "castle %s in %s" % (move.getChessNotation(), fen)
+                gs.undoMove()
+    return True, ""
+
+class MissingTable(Exception):
+    pass
+
+'''
+Stands in for chess.syzygy's tables in the tablebase check: answers (wdl, dtz) for the positions it is given, keyed
+by FEN placement and side to move, and raises MissingTable for the rest unless it has a default answer
+'''
+class FakeTables():
+
+    def __init__(self, answers, default=None):
+        self.answers = answers
+        self.default = default
+
+    def answer(self, fen):
+        key = " ".join(fen.split()[:2])
+        if key in self.answers:
+            return self.answers[key]
+        if self.default is None:
+            raise MissingTable(key)
+        return self.default
+
+    def probe_wdl(self, fen):
+        return self.answer(fen)[0]
+
+    def probe_dtz(self, fen):
+        return self.answer(fen)[1]
+
+    def close(self):
+        pass
+
+'''
+A Tablebase reading from FakeTables
+'''
+def fakeTablebase(answers, default=None):
+    tablebase = ChessTablebase.Tablebase(None)
+    tablebase.loaded = True
+    tablebase.tables = FakeTables(answers, default)
+    return tablebase
+
+'''
+Tablebase move ranking and the in-search WDL scores, against FakeTables since no Syzygy files ship with the engine.
+chess.Board is swapped for str so the fake tables get the FEN
+'''
+def checkTablebase():
+    realChess = ChessTablebase.chess
+    ChessTablebase.chess = types.SimpleNamespace(Board=str, syzygy=types.SimpleNamespace(MissingTableError=MissingTable))
+    try:
+        #winning: of the two moves that keep the win the one with the opponent's dtz closest to 0
+        gs = ChessEngine.GameState.fromFEN("3rk3/8/8/8/8/8/8/3QK3 w - - 0 1")
+        tablebase = fakeTablebase({"3rk3/8/8/8/Q7/8/8/4K3 b": (ChessTablebase.LOSS, -9),
+                                   "3rk3/8/8/7Q/8/8/8/4K3 b": (ChessTablebase.LOSS, -3),
+                                   "3rk3/8/8/8/8/8/8/3QK3 b": (ChessTablebase.WIN, 5)}, (ChessTablebase.DRAW, 0))
+        move = tablebase.bestMove(gs, gs.getValidMoves())
+        if move is None or move.getChessNotation() != "d1h5":
+            return False, "winning move %s, expected d1h5" % move
+        #losing: every move loses, the one holding out longest
+        gs = ChessEngine.GameState.fromFEN("3qk3/8/8/8/8/8/8/4K3 w - - 0 1")
+        tablebase = fakeTablebase({"3qk3/8/8/8/8/8/5K2/8 b": (ChessTablebase.WIN, 12)}, (ChessTablebase.WIN, 4))
+        move = tablebase.bestMove(gs, gs.getValidMoves())
+        if move is None or move.getChessNotation() != "e1f2":
+            return False, "losing move %s, expected e1f2" % move
+        #a missing table part way through gives None and leaves the root's check information as it was
+        gs = ChessEngine.GameState.fromFEN("4k3/8/8/8/8/8/8/r3K3 w - - 0 1")
+        validMoves = gs.getValidMoves()
+        before = (gs.inCheck, list(gs.pins), list(gs.checks), gs.checkMate, gs.staleMate)
+        tablebase = fakeTablebase({"4k3/8/8/8/8/8/3K4/r7 b": (ChessTablebase.DRAW, 0)})
+        if tablebase.bestMove(gs, validMoves) is not None:
+            return False, "a move without all the tables"
+        if (gs.inCheck, gs.pins, gs.checks, gs.checkMate, gs.staleMate) != before:
+            return False, "root check information changed by the children"
+        #in the search: the capture the tables call won beats the one that wins more material but only draws
+        gs = ChessEngine.GameState.fromFEN("4k3/8/8/3n4/7b/6P1/8/3RK3 w - - 0 1")
+        tablebase = fakeTablebase({"4k3/8/8/3R4/7b/6P1/8/4K3 b": (ChessTablebase.DRAW, 0),
+                                   "4k3/8/8/3n4/7P/8/8/3RK3 b": (ChessTablebase.LOSS, -7)})
+        returnQueue = queue.Queue()
+        ChessAi.transpositionTable.clear()
+        stats = ChessAi.findBestMove(gs, gs.getValidMoves(), returnQueue, None, None, 3, tablebase=tablebase)
+        move = returnQueue.get()
+        score = stats.depths[-1]["score"]
+        if move is None or move.getChessNotation() != "g3h4" or score != ChessAi.TABLEBASE_WIN - 1 or stats.tablebaseHits == 0:
+            return False, "search played %s with score %d, expected g3h4 with %d" % (move, score, ChessAi.TABLEBASE_WIN - 1)
+    finally:
+        ChessTablebase.chess = realChess
+        ChessAi.transpositionTable.clear()
+    return True, ""
+
+CHECKS = {"workersync": checkWorkerSync, "matescores": checkMateScores, "parallel": checkParallelFallback,
+          "fen": checkFEN, "tablebase": checkTablebase}
+
+def main():
+    parser = argparse.ArgumentParser(description="Engine regression checks")
+    parser.add_argument("--check", choices=sorted(CHECKS), help="run only this check")
+    args = parser.parse_args()
+    passed = True
+    for name, check in CHECKS.items():
+        if args.check is not None and name != args.check:
+            continue
+        startTime = time.perf_counter()
+        ok, reason = check()
+        print("%-12s %s %.2fs %s" % (name, "ok" if ok else "FAIL", time.perf_counter() - startTime, reason))
+        passed = passed and ok
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
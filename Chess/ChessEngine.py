@@ -2,6 +2,90 @@
 This class is reponsible for the storing all the info about the current state of a chess game. It will also be 
  responsible for determining the valid moves at the current state. It will also keep a move log.
 """
+import random
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+#one byte per piece for the flat 64 square board of a PositionSnapshot, index r*8+c
+pieceCodes = {"--": 0, "wp": 1, "wN": 2, "wB": 3, "wR": 4, "wQ": 5, "wK": 6, "bp": 7, "bN": 8, "bB": 9, "bR": 10, "bQ": 11, "bK": 12}
+pieceNames = sorted(pieceCodes, key=pieceCodes.get)
+
+'''
+Zobrist keys for hashing positions. The generator is seeded so every process gets the same keys
+'''
+zobristRandom = random.Random(2023)
+zobristPieceKeys = {color + piece: [[zobristRandom.getrandbits(64) for c in range(8)] for r in range(8)]
+                    for color in "wb" for piece in "pRNBQK"}
+zobristCastleKeys = [zobristRandom.getrandbits(64) for i in range(4)] #wks, wqs, bks, bqs
+#the castle keys xored together for each 4 bit value of the castling rights, see castleRightsBits
+zobristCastleRightsKeys = [(zobristCastleKeys[0] if rights & 1 else 0) ^ (zobristCastleKeys[1] if rights & 2 else 0) ^
+                           (zobristCastleKeys[2] if rights & 4 else 0) ^ (zobristCastleKeys[3] if rights & 8 else 0)
+                           for rights in range(16)]
+zobristEnpassantKeys = [zobristRandom.getrandbits(64) for c in range(8)] #one per file
+zobristBlackToMove = zobristRandom.getrandbits(64)
+
+UNDO_STACK_SIZE = 256 #undo records made room for at a time, more than a game and a search usually need
+#the castling rights booleans (white kingside, white queenside, black kingside, black queenside) of each 4 bit value
+castleRightsFromBits = [(rights & 1 != 0, rights & 2 != 0, rights & 4 != 0, rights & 8 != 0) for rights in range(16)]
+
+'''
+Evaluation tables in integer centipawns, positive for white and negative for black. Every GameState keeps a running
+material and positional score from these, ChessAi fills them in through setEvaluationTables
+'''
+materialValues = {"--": 0}
+positionValues = {"--": [[0] * 8 for r in range(8)]}
+nonPawnValues = {"--": 0} #what each piece adds to its side's nonPawnMaterial, knights, bishops, rooks and queens only
+
+'''
+Sets the centipawn value of each piece ("wQ", "bp", ...) and its value on each square as an 8x8 list. GameStates
+created before this is called keep their old running scores
+'''
+def setEvaluationTables(pieceMaterialValues, piecePositionValues):
+    materialValues.update(pieceMaterialValues)
+    positionValues.update(piecePositionValues)
+    nonPawnValues.update({piece: 0 if piece[1] in "pK" else abs(value) for piece, value in pieceMaterialValues.items()})
+
+setEvaluationTables({color + piece: 0 for color in "wb" for piece in "pRNBQK"},
+                    {color + piece: [[0] * 8 for r in range(8)] for color in "wb" for piece in "pRNBQK"})
+
+'''
+Move tables built once at import so the move generator and the attack tests never bounds check.
+Directions 0-3 are the rook directions and 4-7 the bishop directions. rayTable[r][c][j] holds the squares from (r, c)
+outward in direction j up to the edge of the board, knightTable[r][c] the (row, col, offset) a knight on (r, c) jumps
+to and kingTable[r][c] the (row, col) next to it
+'''
+directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+knightOffsets = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+rayTable = [[[tuple((r + d[0] * i, c + d[1] * i) for i in range(1, 8) if 0 <= r + d[0] * i < 8 and 0 <= c + d[1] * i < 8)
+              for d in directions] for c in range(8)] for r in range(8)]
+knightTable = [[tuple((r + m[0], c + m[1], m) for m in knightOffsets if 0 <= r + m[0] < 8 and 0 <= c + m[1] < 8)
+                for c in range(8)] for r in range(8)]
+kingTable = [[tuple((r + d[0], c + d[1]) for d in directions if 0 <= r + d[0] < 8 and 0 <= c + d[1] < 8)
+              for c in range(8)] for r in range(8)]
+pieceDirections = {'R': range(0, 4), 'B': range(4, 8), 'Q': range(0, 8)}
+
+'''
+blockingSquares[kingSquare][checkerSquare] is the set of squares (row * 8 + col) a piece can move to to answer a check
+from a sliding piece: every square between the king and the checker, and the checker's own square
+'''
+blockingSquares = [{} for square in range(64)]
+for r in range(8):
+    for c in range(8):
+        for ray in rayTable[r][c]:
+            for i in range(len(ray)):
+                blockingSquares[r * 8 + c][ray[i][0] * 8 + ray[i][1]] = frozenset(row * 8 + col for row, col in ray[:i + 1])
+
+'''
+Piece types of a color that attack a square from direction j, as (types on the next square, types further away).
+A white pawn attacks from the squares below (directions 6 and 7), a black pawn from the squares above (4 and 5)
+'''
+rayAttackers = {}
+for color, pawnDirections in (('w', (6, 7)), ('b', (4, 5))):
+    rayAttackers[color] = []
+    for j in range(8):
+        sliders = "RQ" if j < 4 else "BQ"
+        rayAttackers[color].append((sliders + "K" + ("p" if j in pawnDirections else ""), sliders))
+
 class GameState():
 
     def __init__(self):
@@ -31,21 +115,252 @@ class GameState():
         self.checkMate = False
         self.staleMate = False
         self.enpassantPossible = () #coordinates for the square where enpassant capture is possible
-        self.enpassantPossibleLog = [self.enpassantPossible]
         #castling rights
         self.whiteCastleKingside = True
         self.whiteCastleQueenside = True
         self.blackCastleKingside = True
         self.blackCastleQueenside = True
-        self.castleRightsLog = [CastleRights(self.whiteCastleKingside, self.blackCastleKingside, self.whiteCastleQueenside, self.blackCastleQueenside)] #39
+        #move clocks as in FEN: half moves since the last capture or pawn move, and the number of the current full move
+        self.halfmoveClock = 0
+        self.fullmoveNumber = 1
+        self.startFEN = None #the FEN the game was set up from, None for the normal starting position
+        #zobrist hash of the position, kept up to date by makeMove/undoMove
+        self.zobristKey = self.computeZobristKey()
+        #running evaluation in centipawns, kept up to date by makeMove/undoMove
+        self.materialScore, self.positionScore = self.computeEvaluation()
+        #centipawns of knights, bishops, rooks and queens each side has, kept up to date by makeMove/undoMove
+        self.nonPawnMaterial = self.computeNonPawnMaterial()
+        #what undoMove can't work out from each move in moveLog, indexed by ply, see pushUndoRecord
+        self.undoStates = [0] * UNDO_STACK_SIZE
+        self.undoKeys = [0] * UNDO_STACK_SIZE
+        self.undoMaterialScores = [0] * UNDO_STACK_SIZE
+        self.undoPositionScores = [0] * UNDO_STACK_SIZE
+
+    '''
+    Computes the material and positional score of the current position from scratch
+    '''
+    def computeEvaluation(self):
+        material = 0
+        position = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    material += materialValues[piece]
+                    position += positionValues[piece][r][c]
+        return material, position
+
+    '''
+    Computes the non-pawn material of each side from scratch, as {"w": centipawns, "b": centipawns}
+    '''
+    def computeNonPawnMaterial(self):
+        nonPawnMaterial = {"w": 0, "b": 0}
+        for row in self.board:
+            for piece in row:
+                if piece != "--":
+                    nonPawnMaterial[piece[0]] += nonPawnValues[piece]
+        return nonPawnMaterial
+
+    '''
+    Computes the zobrist hash of the current position from scratch
+    '''
+    def computeZobristKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= zobristPieceKeys[piece][r][c]
+        key ^= self.castleRightsKey()
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassantKeys[self.enpassantPossible[1]]
+        if not self.whiteToMove:
+            key ^= zobristBlackToMove
+        return key
+
+    '''
+    Returns the part of the zobrist hash that comes from the current castling rights
+    '''
+    def castleRightsKey(self):
+        return zobristCastleRightsKeys[self.castleRightsBits()]
+
+    '''
+    Creates a GameState set up from a FEN string
+    '''
+    @classmethod
+    def fromFEN(cls, fen):
+        gs = cls()
+        gs.loadFEN(fen)
+        return gs
+
+    '''
+    Sets up the position of a FEN string, replacing the whole game. The board, king locations, zobrist key and running
+    evaluation are all built in the same pass over the piece placement. Raises ValueError for a FEN it can't read,
+    castling rights the FEN gives a king or rook not on its starting square are dropped
+    '''
+    def loadFEN(self, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least the placement, side, castling and enpassant fields: " + fen)
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError("FEN placement needs 8 ranks: " + fen)
+        pieceNames = {'p': 'p', 'r': 'R', 'n': 'N', 'b': 'B', 'q': 'Q', 'k': 'K'}
+        self.board = [["--"] * 8 for r in range(8)]
+        key = 0
+        material = 0
+        position = 0
+        nonPawnMaterial = {"w": 0, "b": 0}
+        for r, rank in enumerate(ranks):
+            c = 0
+            for char in rank:
+                if char.isdigit():
+                    c += int(char)
+                    continue
+                if char.lower() not in pieceNames or c > 7:
+                    raise ValueError("bad FEN rank " + rank)
+                piece = ('w' if char.isupper() else 'b') + pieceNames[char.lower()]
+                self.board[r][c] = piece
+                if piece == 'wK':
+                    self.whiteKingLocation = (r, c)
+                elif piece == 'bK':
+                    self.blackKingLocation = (r, c)
+                key ^= zobristPieceKeys[piece][r][c]
+                material += materialValues[piece]
+                position += positionValues[piece][r][c]
+                nonPawnMaterial[piece[0]] += nonPawnValues[piece]
+                c += 1
+            if c != 8:
+                raise ValueError("bad FEN rank " + rank)
+        if fields[1] not in ('w', 'b'):
+            raise ValueError("FEN side to move has to be w or b: " + fen)
+        self.whiteToMove = fields[1] == 'w'
+        #a right whose king or rook isn't on its starting square can't be used, makeMove would move a piece that isn't there
+        whiteKingHome = self.board[7][4] == 'wK'
+        blackKingHome = self.board[0][4] == 'bK'
+        self.whiteCastleKingside = 'K' in fields[2] and whiteKingHome and self.board[7][7] == 'wR'
+        self.whiteCastleQueenside = 'Q' in fields[2] and whiteKingHome and self.board[7][0] == 'wR'
+        self.blackCastleKingside = 'k' in fields[2] and blackKingHome and self.board[0][7] == 'bR'
+        self.blackCastleQueenside = 'q' in fields[2] and blackKingHome and self.board[0][0] == 'bR'
+        if fields[3] != '-':
+            self.enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+            key ^= zobristEnpassantKeys[self.enpassantPossible[1]]
+        else:
+            self.enpassantPossible = ()
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        key ^= self.castleRightsKey()
+        if not self.whiteToMove:
+            key ^= zobristBlackToMove
+        self.zobristKey = key
+        self.materialScore = material
+        self.positionScore = position
+        self.nonPawnMaterial = nonPawnMaterial
+        self.moveLog = []
+        self.inCheck = False
+        self.pins = []
+        self.checks = []
+        self.checkMate = False
+        self.staleMate = False
+        self.startFEN = fen
+
+    '''
+    Returns the FEN string of the current position
+    '''
+    def toFEN(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty > 0:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            if empty > 0:
+                rank += str(empty)
+            ranks.append(rank)
+        castling = ("K" if self.whiteCastleKingside else "") + ("Q" if self.whiteCastleQueenside else "") + \
+            ("k" if self.blackCastleKingside else "") + ("q" if self.blackCastleQueenside else "")
+        enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]] if self.enpassantPossible != () else "-"
+        return " ".join(("/".join(ranks), 'w' if self.whiteToMove else 'b', castling or "-", enpassant,
+                         str(self.halfmoveClock), str(self.fullmoveNumber)))
+
+    '''
+    Takes a PositionSnapshot of the current position
+    '''
+    def snapshot(self):
+        return PositionSnapshot(self)
+
+    '''
+    Goes back to the position of a snapshot. If the snapshot was taken earlier on the line this GameState is playing
+    the moves since are undone, which keeps the move history. Otherwise the board rows are refilled in place and the
+    game restarts from the snapshot's position, as loadFEN would
+    '''
+    def restore(self, snapshot):
+        count = snapshot.moveCount
+        if count <= len(self.moveLog) and self.positionKey(count) == snapshot.zobristKey:
+            while len(self.moveLog) > count:
+                if self.moveLog[-1] is None:
+                    self.undoNullMove()
+                else:
+                    self.undoMove()
+            return
+        squares = snapshot.squares
+        for r in range(8):
+            row = self.board[r]
+            for c in range(8):
+                row[c] = pieceNames[squares[r * 8 + c]]
+        self.whiteKingLocation = divmod(squares.index(pieceCodes["wK"]), 8)
+        self.blackKingLocation = divmod(squares.index(pieceCodes["bK"]), 8)
+        self.whiteToMove = snapshot.whiteToMove
+        self.setCastleRightsBits(snapshot.castleRights)
+        self.enpassantPossible = snapshot.enpassantPossible
+        self.halfmoveClock = snapshot.halfmoveClock
+        self.fullmoveNumber = snapshot.fullmoveNumber
+        self.zobristKey = snapshot.zobristKey
+        self.materialScore, self.positionScore = snapshot.evaluation
+        self.nonPawnMaterial = {"w": snapshot.nonPawnMaterial[0], "b": snapshot.nonPawnMaterial[1]}
+        self.moveLog = []
+        self.inCheck = False
+        self.pins = []
+        self.checks = []
+        self.checkMate = False
+        self.staleMate = False
+        self.startFEN = self.toFEN()
+
+    '''
+    A new GameState at the position of a snapshot
+    '''
+    @classmethod
+    def fromSnapshot(cls, snapshot):
+        gs = cls()
+        gs.restore(snapshot)
+        return gs
+
     '''
     Takes a Move as a parameter and executes it (will not work for castling, pawn promotion, and en-passant)
     '''
     def makeMove(self, move):
+        castleRights = self.pushUndoRecord() & 15 #save what undoMove can't work out from the move
+        #take the moving piece, captured piece and old enpassant square out of the hash
+        key = self.zobristKey ^ zobristBlackToMove
+        key ^= zobristPieceKeys[move.pieceMoved][move.startRow][move.startCol]
+        if move.pieceCaptured != "--" and not move.isEnpassantMove:
+            key ^= zobristPieceKeys[move.pieceCaptured][move.endRow][move.endCol]
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassantKeys[self.enpassantPossible[1]]
+
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move) #log the move to we can undo or display history
+        if not self.whiteToMove: #a full move is over once black has moved
+            self.fullmoveNumber += 1
         self.whiteToMove = not self.whiteToMove #swap players turns
+        self.halfmoveClock = 0 if move.pieceMoved[1] == 'p' or move.pieceCaptured != "--" else self.halfmoveClock + 1
         #update the king's location if moved
         if move.pieceMoved == 'wK':
             self.whiteKingLocation = (move.endRow, move.endCol)
@@ -54,7 +369,7 @@ class GameState():
         #pawn promotion
         if move.isPawnPromotion: 
             #user input for pawn promotion
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q' #at the board position the pawn moves to gets replaced by [color]piece
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionPiece #at the board position the pawn moves to gets replaced by [color]piece
         #enpassant move
         if move.isEnpassantMove:
             self.board[move.startRow][move.endCol] = '--' #capturing the pawn
@@ -73,13 +388,43 @@ class GameState():
                 self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 2] #move rook
                 self.board[move.endRow][move.endCol - 2] = '--' #empty space where rook was
 
-
-        self.enpassantPossibleLog.append(self.enpassantPossible)
-
         #update castling rights - whenever it is a rook or a king move
         self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.whiteCastleKingside, self.blackCastleKingside, self.whiteCastleQueenside, self.blackCastleQueenside))
 
+        #put the piece on the end square, the castled rook, new enpassant square and the castle rights lost into the hash
+        key ^= zobristPieceKeys[self.board[move.endRow][move.endCol]][move.endRow][move.endCol]
+        if move.isEnpassantMove:
+            key ^= zobristPieceKeys[move.pieceCaptured][move.startRow][move.endCol]
+        if move.castle:
+            rook = move.pieceMoved[0] + 'R'
+            if move.endCol - move.startCol == 2: #kingside
+                key ^= zobristPieceKeys[rook][move.endRow][move.endCol + 1] ^ zobristPieceKeys[rook][move.endRow][move.endCol - 1]
+            else: #queenside
+                key ^= zobristPieceKeys[rook][move.endRow][move.endCol - 2] ^ zobristPieceKeys[rook][move.endRow][move.endCol + 1]
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassantKeys[self.enpassantPossible[1]]
+        key ^= zobristCastleRightsKeys[castleRights ^ self.castleRightsBits()]
+        self.zobristKey = key
+
+        #update the running evaluation for the squares that changed
+        endPiece = self.board[move.endRow][move.endCol]
+        material = self.materialScore - materialValues[move.pieceMoved] + materialValues[endPiece]
+        position = self.positionScore - positionValues[move.pieceMoved][move.startRow][move.startCol] + positionValues[endPiece][move.endRow][move.endCol]
+        if move.pieceCaptured != "--":
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow
+            material -= materialValues[move.pieceCaptured]
+            position -= positionValues[move.pieceCaptured][captureRow][move.endCol]
+            self.nonPawnMaterial[move.pieceCaptured[0]] -= nonPawnValues[move.pieceCaptured]
+        if move.isPawnPromotion:
+            self.nonPawnMaterial[endPiece[0]] += nonPawnValues[endPiece]
+        if move.castle:
+            rookValues = positionValues[move.pieceMoved[0] + 'R'][move.endRow]
+            if move.endCol - move.startCol == 2: #kingside
+                position += rookValues[move.endCol - 1] - rookValues[move.endCol + 1]
+            else: #queenside
+                position += rookValues[move.endCol + 1] - rookValues[move.endCol - 2]
+        self.materialScore = material
+        self.positionScore = position
 
     '''
     Undo the last move made
@@ -90,6 +435,9 @@ class GameState():
             self.board[move.startRow][move.startCol] = move.pieceMoved
             self.board[move.endRow][move.endCol] = move.pieceCaptured
             self.whiteToMove = not self.whiteToMove #switched turns back
+            if not self.whiteToMove:
+                self.fullmoveNumber -= 1
+            self.popUndoRecord() #castle rights, enpassant square, halfmove clock, hash and evaluation from before the move
             #update the king's position if needed
             if move.pieceMoved == 'wK':
                 self.whiteKingLocation = (move.startRow, move.startCol)
@@ -99,18 +447,7 @@ class GameState():
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = '--' #leave landing square blank
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
-            
-            self.enpassantPossibleLog.pop()
-            self.enpassantPossible = self.enpassantPossibleLog[-1]
-            
-            #give back castling right if move took them away
-            self.castleRightsLog.pop() #get rid of new castle rights from move we are undoing
-            castleRights = self.castleRightsLog[-1] #set the current castle rights to the current lastest one in the list
-            self.whiteCastleKingside = castleRights.wks
-            self.whiteCastleQueenside = castleRights.wqs
-            self.blackCastleKingside = castleRights.bks
-            self.blackCastleQueenside = castleRights.bqs
-    
+
             #undo castle
             if move.castle:
                 if move.endCol - move.startCol == 2: #kingside
@@ -119,11 +456,108 @@ class GameState():
                 else: #queenside
                     self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][move.endCol+1] #move rook
                     self.board[move.endRow][move.endCol + 1] = '--' #empty space where rook was
+
+            #non-pawn material back, worked out from the move rather than saved like the running evaluation
+            if move.pieceCaptured != "--":
+                self.nonPawnMaterial[move.pieceCaptured[0]] += nonPawnValues[move.pieceCaptured]
+            if move.isPawnPromotion:
+                self.nonPawnMaterial[move.pieceMoved[0]] -= nonPawnValues[move.pieceMoved[0] + move.promotionPiece]
                 
             self.checkMate = False
             self.staleMate = False
 
+    '''
+    Passes the turn without moving a piece, used by the search's null move pruning. Only the side to move and the
+    en passant square change. It goes in the moveLog as None and has to be taken back with undoNullMove
+    '''
+    def makeNullMove(self):
+        self.pushUndoRecord()
+        key = self.zobristKey ^ zobristBlackToMove
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassantKeys[self.enpassantPossible[1]]
+        self.moveLog.append(None)
+        if not self.whiteToMove:
+            self.fullmoveNumber += 1
+        self.whiteToMove = not self.whiteToMove
+        self.halfmoveClock += 1
+        self.enpassantPossible = ()
+        self.zobristKey = key
+
+    def undoNullMove(self):
+        self.moveLog.pop()
+        self.whiteToMove = not self.whiteToMove
+        if not self.whiteToMove:
+            self.fullmoveNumber -= 1
+        self.popUndoRecord()
+
+    '''
+    The castling rights as 4 bits: white kingside 1, white queenside 2, black kingside 4, black queenside 8. The undo
+    records and PositionSnapshot keep them this way
+    '''
+    def castleRightsBits(self):
+        return self.whiteCastleKingside | self.whiteCastleQueenside << 1 | self.blackCastleKingside << 2 | self.blackCastleQueenside << 3
+
+    def setCastleRightsBits(self, rights):
+        self.whiteCastleKingside, self.whiteCastleQueenside, self.blackCastleKingside, self.blackCastleQueenside = castleRightsFromBits[rights]
+
+    '''
+    Saves what makeMove changes but undoMove can't work out from the Move in the undo slots of the current ply: the
+    state (castling rights in bits 0-3, enpassant file + 1 in bits 4-7 and the halfmove clock from bit 8 on), zobrist
+    key, material score and position score. The captured piece is already kept in the Move. The slots are made once
+    and written over, so a move allocates no record. The only place the record is packed, popUndoRecord the only
+    place it is unpacked. Returns the packed state
+    '''
+    def pushUndoRecord(self):
+        ply = len(self.moveLog)
+        if ply == len(self.undoKeys):
+            for slots in (self.undoStates, self.undoKeys, self.undoMaterialScores, self.undoPositionScores):
+                slots.extend([0] * UNDO_STACK_SIZE)
+        #castleRightsBits and setCastleRightsBits are written out here and in popUndoRecord, this runs for every move
+        state = self.whiteCastleKingside | self.whiteCastleQueenside << 1 | self.blackCastleKingside << 2 | \
+            self.blackCastleQueenside << 3 | self.halfmoveClock << 8
+        if self.enpassantPossible != ():
+            state |= self.enpassantPossible[1] + 1 << 4
+        self.undoStates[ply] = state
+        self.undoKeys[ply] = self.zobristKey
+        self.undoMaterialScores[ply] = self.materialScore
+        self.undoPositionScores[ply] = self.positionScore
+        return state
 
+    '''
+    Puts back the state saved for the ply of the move just taken off the moveLog, whiteToMove has to be switched back
+    first
+    '''
+    def popUndoRecord(self):
+        ply = len(self.moveLog)
+        state = self.undoStates[ply]
+        self.zobristKey = self.undoKeys[ply]
+        self.materialScore = self.undoMaterialScores[ply]
+        self.positionScore = self.undoPositionScores[ply]
+        self.whiteCastleKingside, self.whiteCastleQueenside, self.blackCastleKingside, self.blackCastleQueenside = castleRightsFromBits[state & 15]
+        enpassantFile = state >> 4 & 15
+        #the square behind a pawn the other side just moved two squares
+        self.enpassantPossible = (2 if self.whiteToMove else 5, enpassantFile - 1) if enpassantFile else ()
+        self.halfmoveClock = state >> 8
+
+    '''
+    Zobrist key of the position after the first ply moves of the moveLog
+    '''
+    def positionKey(self, ply):
+        return self.zobristKey if ply == len(self.moveLog) else self.undoKeys[ply]
+
+    '''
+    How many times the current position has been on the board, counting now. Only the positions since the last
+    capture or pawn move can repeat it
+    '''
+    def repetitions(self):
+        count = 1
+        ply = len(self.moveLog) - 2
+        lastPly = max(0, len(self.moveLog) - self.halfmoveClock)
+        while ply >= lastPly:
+            if self.undoKeys[ply] == self.zobristKey:
+                count += 1
+            ply -= 2
+        return count
 
     '''
     ALL moves considering checks
@@ -139,27 +573,19 @@ class GameState():
             kingCol = self.blackKingLocation[1]
         if self.inCheck:
             if len(self.checks) == 1: #only 1 check, block check or move king
-                moves = self.getAllPossibleMoves()
                 #to block a check you must move a piece into one of the squareds between the enemy piece and king
                 check = self.checks[0] #check info
                 checkRow = check[0]
                 checkCol = check[1]
                 pieceChecking= self.board[checkRow][checkCol] #enemy piece causing the check
-                validSquares = [] #squares that pieces can move to
                 #if knight, must capture knight or move king, other pieces can be blocked
                 if pieceChecking[1] == 'N':
-                    validSquares = [(checkRow, checkCol)]
+                    validSquares = (checkRow * 8 + checkCol,)
                 else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i) #check[2] and check[3] are the check directions
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol: #once you get to piece end checks
-                            break
-                #get rid of any moves that don't block check or move king
-                for i in range(len(moves) - 1, - 1, -1): #go through backwards when you are removing from a list as iterating
-                    if moves[i].pieceMoved[1] != 'K': #move doesn't move king so it must block or capture piece
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares: #move doesn't block check or capture piece
-                            moves.remove(moves[i])
+                    validSquares = blockingSquares[kingRow * 8 + kingCol][checkRow * 8 + checkCol]
+                #keep only the moves that move the king, block the check or capture the piece (enpassant was checked when generated)
+                moves = [move for move in self.getAllPossibleMoves() if move.pieceMoved[1] == 'K' or move.isEnpassantMove or
+                         move.endRow * 8 + move.endCol in validSquares]
             else: #double check, king has to move
                 self.getKingMoves(kingRow, kingCol, moves)
         else: #not in check so all moves are fine
@@ -188,6 +614,61 @@ class GameState():
                     self.moveFunctions[piece](r, c, moves)  #calls approriate move function based on piece type // more efficent than several elif statements for each piece
         return moves
 
+    '''
+    Legal captures and promotions only, for the quiescence search. Works backwards from each enemy piece to the allied
+    pieces attacking it instead of generating every move. When in check every evasion matters, so this falls back to
+    getValidMoves. Checkmate and stalemate can't be known from captures alone, so those flags are cleared
+    '''
+    def getValidCaptures(self):
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.inCheck:
+            return self.getValidMoves()
+        self.checkMate = False
+        self.staleMate = False
+        allyColor = 'w' if self.whiteToMove else 'b'
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        pinDirections = {(pin[0], pin[1]): (pin[2], pin[3]) for pin in self.pins}
+        moves = []
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c][0] != enemyColor:
+                    continue
+                for attackRow, attackCol, d in self.getAttackers(r, c, allyColor):
+                    piece = self.board[attackRow][attackCol][1]
+                    if piece == 'K':
+                        if self.kingMoveIsSafe(attackRow, attackCol, r, c):
+                            moves.append(Move((attackRow, attackCol), (r, c), self.board))
+                        continue
+                    pinDirection = pinDirections.get((attackRow, attackCol))
+                    if pinDirection is not None and piece != 'N' and (pinDirection == d or pinDirection == (-d[0], -d[1])):
+                        pinDirection = None #moving along the pin line
+                    if pinDirection is None:
+                        if piece == 'p':
+                            self.addPawnMove((attackRow, attackCol), (r, c), moves)
+                        else:
+                            moves.append(Move((attackRow, attackCol), (r, c), self.board))
+        #enpassant captures and promotions that don't capture come from the normal pawn generator
+        pawnRows = [1 if self.whiteToMove else 6]
+        if self.enpassantPossible != ():
+            pawnRows.append(self.enpassantPossible[0] + (1 if self.whiteToMove else -1))
+        for r in pawnRows:
+            for c in range(8):
+                if self.board[r][c] == allyColor + 'p':
+                    pawnMoves = []
+                    self.getPawnMoves(r, c, pawnMoves)
+                    moves.extend(move for move in pawnMoves if move.isEnpassantMove or (move.isPawnPromotion and not move.isCapture))
+        return moves
+
+    '''
+    Returns if the king at (r, c) can move to (endRow, endCol) without being in check there
+    '''
+    def kingMoveIsSafe(self, r, c, endRow, endCol):
+        king = self.board[r][c]
+        self.board[r][c] = "--" #so the king doesn't block an attack along the line it is moving on
+        safe = not self.squareUnderAttack(endRow, endCol, king[0])
+        self.board[r][c] = king
+        return safe
+
     ''' #187
     Get all the pawn moves for the pawn located at row, col and add these moves to the list
     '''
@@ -201,123 +682,73 @@ class GameState():
                 self.pins.remove(self.pins[i])
                 break
         
+        #a pinned pawn may still move along the line of the pin, towards or away from its king
         if self.whiteToMove: #white pawn moves
-            kingRow, kingCol = self.whiteKingLocation
             if self.board[r-1][c] == "--": #1 square pawn advance
-                if not piecePinned or pinDirection == (-1, 0):
-                    moves.append(Move((r, c), (r-1, c), self.board))
+                if not piecePinned or pinDirection in ((-1, 0), (1, 0)):
+                    self.addPawnMove((r, c), (r-1, c), moves)
                     if r == 6 and self.board[r-2][c] == "--": #2 square pawn advance
                         moves.append(Move((r, c), (r-2, c), self.board))
             #captures
             if c-1 >= 0: #captures to the left
-                if not piecePinned or pinDirection == (-1, -1):
+                if not piecePinned or pinDirection in ((-1, -1), (1, 1)):
                     if self.board[r-1][c-1][0] == 'b': #enemy piece to capture
-                        moves.append(Move((r, c), (r-1, c-1), self.board))
-                    if (r-1, c-1) == self.enpassantPossible:
-                        attackingPiece = blockingPiece = False
-                        if kingRow == r:
-                            if kingCol < c: #king is left of the pawn
-                                #inside between king and pawn; outside range between pawn border
-                                insideRange = range(kingCol + 1, c-1)
-                                outsideRange = range(c+1, 8)
-                            else: #king right of the pawn
-                                insideRange = range(kingCol - 1, c, -1)
-                                outsideRange = range(c-2, -1, -1)
-                            for i in insideRange:
-                                if self.board[r][i] != "--": #some other piece beside enpassant pawn blocks
-                                    blockingPiece=True
-                            for i in outsideRange:
-                                square = self.board[r][i]
-                                if square[0] == 'b' and (square[1] == "R" or square[1] == "Q"): #attacking piece
-                                    attackingPiece=True
-                                elif square != "--":
-                                    blockingPiece=True
-                        if not attackingPiece or blockingPiece:
-                            moves.append(Move((r, c), (r-1, c-1), self.board, isEnpassantMove=True))
+                        self.addPawnMove((r, c), (r-1, c-1), moves)
+                    if (r-1, c-1) == self.enpassantPossible and self.enpassantIsSafe(r, c, r-1, c-1):
+                        moves.append(Move((r, c), (r-1, c-1), self.board, isEnpassantMove=True))
             if c+1 <= 7: #captures to the right
-                if not piecePinned or pinDirection == (-1, 1):
+                if not piecePinned or pinDirection in ((-1, 1), (1, -1)):
                     if self.board[r-1][c+1][0] == 'b': #enemy piece to capture
-                        moves.append(Move((r, c), (r-1, c+1), self.board))
-                    if (r-1, c+1) == self.enpassantPossible:
-                        attackingPiece = blockingPiece = False
-                        if kingRow == r:
-                            if kingCol < c: #king is left of the pawn
-                                #inside between king and pawn; outside range between pawn border
-                                insideRange = range(kingCol + 1, c)
-                                outsideRange = range(c + 2, 8)
-                            else: #king right of the pawn
-                                insideRange = range(kingCol - 1, c + 1, -1)
-                                outsideRange = range(c - 1, -1, -1)
-                            for i in insideRange:
-                                if self.board[r][i] != "--": #some other piece beside enpassant pawn blocks
-                                    blockingPiece=True
-                            for i in outsideRange:
-                                square = self.board[r][i]
-                                if square[0] == 'b' and (square[1] == "R" or square[1] == "Q"): #attacking piece
-                                    attackingPiece=True
-                                elif square != "--":
-                                    blockingPiece=True
-                        if not attackingPiece or blockingPiece:
-                            moves.append(Move((r, c), (r-1, c+1), self.board, isEnpassantMove=True))
+                        self.addPawnMove((r, c), (r-1, c+1), moves)
+                    if (r-1, c+1) == self.enpassantPossible and self.enpassantIsSafe(r, c, r-1, c+1):
+                        moves.append(Move((r, c), (r-1, c+1), self.board, isEnpassantMove=True))
 
         else: #black pawn moves
-            kingRow, kingCol = self.blackKingLocation
             if self.board[r+1][c] == "--": #1 square pawn advance
-                if not piecePinned or pinDirection == (1, 0):
-                    moves.append(Move((r, c), (r+1, c), self.board))
+                if not piecePinned or pinDirection in ((1, 0), (-1, 0)):
+                    self.addPawnMove((r, c), (r+1, c), moves)
                     if r == 1 and self.board[r+2][c] == "--": #2 square pawn advance
                         moves.append(Move((r, c), (r+2, c), self.board))
             # captures
             if c-1 >= 0: #captures to the left
-                if not piecePinned or pinDirection == (1, -1):
+                if not piecePinned or pinDirection in ((1, -1), (-1, 1)):
                     if self.board[r+1][c-1][0] == 'w': #enemy piece to capture
-                        moves.append(Move((r, c), (r+1, c-1), self.board))
-                    if (r+1, c-1) == self.enpassantPossible:
-                        attackingPiece = blockingPiece = False
-                        if kingRow == r:
-                            if kingCol < c: #king is left of the pawn
-                                #inside between king and pawn; outside range between pawn border
-                                insideRange = range(kingCol + 1, c-1)
-                                outsideRange = range(c+1, 8)
-                            else: #king right of the pawn
-                                insideRange = range(kingCol - 1, c, -1)
-                                outsideRange = range(c-2, -1, -1)
-                            for i in insideRange:
-                                if self.board[r][i] != "--": #some other piece beside enpassant pawn blocks
-                                    blockingPiece=True
-                            for i in outsideRange:
-                                square = self.board[r][i]
-                                if square[0] == 'w' and (square[1] == "R" or square[1] == "Q"): #attacking piece
-                                    attackingPiece=True
-                                elif square != "--":
-                                    blockingPiece=True
-                        if not attackingPiece or blockingPiece:
-                            moves.append(Move((r, c), (r+1, c-1), self.board, isEnpassantMove=True))
+                        self.addPawnMove((r, c), (r+1, c-1), moves)
+                    if (r+1, c-1) == self.enpassantPossible and self.enpassantIsSafe(r, c, r+1, c-1):
+                        moves.append(Move((r, c), (r+1, c-1), self.board, isEnpassantMove=True))
             if c+1 <= 7: #captures to the right
-                if not piecePinned or pinDirection == (1, 1):
+                if not piecePinned or pinDirection in ((1, 1), (-1, -1)):
                     if self.board[r+1][c+1][0] == 'w': #enemy piece to capture
-                        moves.append(Move((r, c), (r+1, c+1), self.board))
-                    if (r+1, c+1) == self.enpassantPossible:
-                        attackingPiece = blockingPiece = False
-                        if kingRow == r:
-                            if kingCol < c: #king is left of the pawn
-                                #inside between king and pawn; outside range between pawn border
-                                insideRange = range(kingCol + 1, c)
-                                outsideRange = range(c + 2, 8)
-                            else: #king right of the pawn
-                                insideRange = range(kingCol - 1, c + 1, -1)
-                                outsideRange = range(c - 1, -1, -1)
-                            for i in insideRange:
-                                if self.board[r][i] != "--": #some other piece beside enpassant pawn blocks
-                                    blockingPiece=True
-                            for i in outsideRange:
-                                square = self.board[r][i]
-                                if square[0] == 'w' and (square[1] == "R" or square[1] == "Q"): #attacking piece
-                                    attackingPiece=True
-                                elif square != "--":
-                                    blockingPiece=True
-                        if not attackingPiece or blockingPiece:
-                            moves.append(Move((r, c), (r+1, c+1), self.board, isEnpassantMove=True))
+                        self.addPawnMove((r, c), (r+1, c+1), moves)
+                    if (r+1, c+1) == self.enpassantPossible and self.enpassantIsSafe(r, c, r+1, c+1):
+                        moves.append(Move((r, c), (r+1, c+1), self.board, isEnpassantMove=True))
+
+    '''
+    Adds a pawn move to the list, as one move per piece the pawn can become if it reaches the last rank
+    '''
+    def addPawnMove(self, startSq, endSq, moves):
+        move = Move(startSq, endSq, self.board)
+        moves.append(move)
+        if move.isPawnPromotion:
+            for piece in Move.promotionPieces[1:]:
+                moves.append(Move(startSq, endSq, self.board, promotionPiece=piece))
+
+    '''
+    Returns if capturing enpassant with the pawn at (r, c) leaves the king safe. The capture is tried on the board because
+    taking the enemy pawn off can uncover an attack along the rank or a diagonal, or take away a pawn that was giving check
+    '''
+    def enpassantIsSafe(self, r, c, endRow, endCol):
+        allyColor = self.board[r][c][0]
+        capturedPiece = self.board[r][endCol]
+        self.board[r][c] = "--"
+        self.board[r][endCol] = "--"
+        self.board[endRow][endCol] = allyColor + 'p'
+        kingRow, kingCol = self.whiteKingLocation if allyColor == 'w' else self.blackKingLocation
+        safe = not self.squareUnderAttack(kingRow, kingCol, allyColor)
+        self.board[r][c] = allyColor + 'p'
+        self.board[r][endCol] = capturedPiece
+        self.board[endRow][endCol] = "--"
+        return safe
 
     ''' #165
     Get all the rook moves for the rook located at row, col and add these moves to the list
@@ -332,25 +763,28 @@ class GameState():
                 if self.board[r][c][1] != 'Q': #can't remove queen from pin on rook moves, only remove it from bishop moves
                     self.pins.remove(self.pins[i])
                 break
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1)) #1st var how to change the row and 2nd var to how to change cols ((up, 0), (0, left), (down, 0), (0, right)) 
-        enemyColor = "b" if self.whiteToMove else "w" #1 line version of traditional if else statement
-        for d in directions: #(-1, 0)
-            for i in range(1, 8):
-                endRow = r + d[0] * i #only changes one direction as 0 x 0 is 0
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8: # moves on board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--": #empty valid space
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor: #enemy piece valid
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break
-                        else: #friendly piece invalid
-                            break
-                else: #off board
+        self.getSlidingMoves(r, c, range(0, 4), piecePinned, pinDirection, moves) #up, left, down, right
 
+    '''
+    Adds the moves of a rook, bishop or queen on (r, c) along the given directions, stopping at the first piece in each
+    '''
+    def getSlidingMoves(self, r, c, directionIndexes, piecePinned, pinDirection, moves):
+        enemyColor = "b" if self.whiteToMove else "w" #1 line version of traditional if else statement
+        rays = rayTable[r][c]
+        for j in directionIndexes:
+            d = directions[j]
+            if piecePinned and pinDirection != d and pinDirection != (-d[0], -d[1]):
+                continue #a pinned piece can only move along the pin
+            for endRow, endCol in rays[j]:
+                endPiece = self.board[endRow][endCol]
+                if endPiece == "--": #empty valid space
+                    moves.append(Move((r, c), (endRow, endCol), self.board))
+                elif endPiece[0] == enemyColor: #enemy piece valid
+                    moves.append(Move((r, c), (endRow, endCol), self.board))
                     break
+                else: #friendly piece invalid
+                    break
+
     '''
     Get all the knight moves for the rook located at row, col and add these moves to the list
     '''
@@ -361,16 +795,13 @@ class GameState():
                 piecePinned = True
                 self.pins.remove(self.pins[i])
                 break
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, 2), (1, -2), (2, -1), (2, 1))
+        if piecePinned: #a knight can never move along a pin
+            return
         allyColor = "w" if self.whiteToMove else "b"
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                if not piecePinned:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != allyColor: #not an ally piece (empty or enemy piece)
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+        for endRow, endCol, m in knightTable[r][c]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] != allyColor: #not an ally piece (empty or enemy piece)
+                moves.append(Move((r, c), (endRow, endCol), self.board))
 
     '''
     Get all the bishop moves for the rook located at row, col and add these moves to the list
@@ -384,24 +815,7 @@ class GameState():
                 pinDirection = (self.pins[i][2], self.pins[i][3])
                 self.pins.remove(self.pins[i])
                 break
-        directions = ((-1, 1), (-1, -1), (1, -1), (1 , 1)) #4 diagonals
-        enemyColor = "b" if self.whiteToMove else "w" #1 line version of traditional if else statement
-        for d in directions: #(-1, 0)
-            for i in range(1, 8): #bishop can move max 7 squares
-                endRow = r + d[0] * i #only changes one direction as 0 x 0 is 0
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8: # moves on board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--": #empty valid space
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor: #enemy piece valid
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break
-                        else: #friendly piece invalid
-                            break
-                else: #off board
-                    break
+        self.getSlidingMoves(r, c, range(4, 8), piecePinned, pinDirection, moves) #4 diagonals
 
     ''' -7
     Get all the queen moves for the rook located at row, col and add these moves to the list
@@ -414,101 +828,131 @@ class GameState():
     Get all the king moves for the rook located at row, col and add these moves to the list
     '''
     def getKingMoves(self, r, c, moves):
-        rowMoves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        colMoves = (-1, 0, 1, -1, 1, -1, 0, 1)
         allyColor = "w" if self.whiteToMove else "b"
-        for i in range(8):
-            endRow = r + rowMoves[i]
-            endCol = c + colMoves[i]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor: #not an ally piece (empty or enemy piece)
-                    # place king on end square and check for checks
-                    if allyColor == 'w':
-                        self.whiteKingLocation = (endRow, endCol)
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    # place king back on original location
-                    if allyColor == 'w':
-                        self.whiteKingLocation = (r, c)
-                    else:
-                        self.blackKingLocation = (r, c)
-        self.getCastleMoves(r, c, moves, allyColor)
+        attackMap = self.getAttackMap("b" if self.whiteToMove else "w") #worked out once for every king square and castling
+        for endRow, endCol in kingTable[r][c]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] != allyColor and endRow * 8 + endCol not in attackMap: #empty or enemy piece, and not attacked
+                moves.append(Move((r, c), (endRow, endCol), self.board))
+        self.getCastleMoves(r, c, moves, allyColor, attackMap)
     
     '''
-    Generate all valid castle moves for the king at (r, c) and add them to the list of moves
+    Generate all valid castle moves for the king at (r, c) and add them to the list of moves. attackMap is the set of
+    squares the enemy attacks, worked out here if the caller doesn't have it
     '''
-    def getCastleMoves(self, r, c, moves, allyColor): #359
-        inCheck = self.squareUnderAttack(r, c, allyColor)
-        if inCheck:
+    def getCastleMoves(self, r, c, moves, allyColor, attackMap=None): #359
+        if attackMap is None:
+            attackMap = self.getAttackMap('b' if allyColor == 'w' else 'w')
+        if r * 8 + c in attackMap:
             return #can't castle whistle in check
         if (self.whiteToMove and self.whiteCastleKingside) or (not self.whiteToMove and self.blackCastleKingside):
-            self.getKingsideCastleMoves(r, c, moves, allyColor)
+            self.getKingsideCastleMoves(r, c, moves, attackMap)
         if (self.whiteToMove and self.whiteCastleQueenside) or (not self.whiteToMove and self.blackCastleQueenside):
-            self.getQueensideCastleMoves(r, c, moves, allyColor)
+            self.getQueensideCastleMoves(r, c, moves, attackMap)
 
     #
     #Generate kingside castle moves for the king at (r, c). this method will only be called if player still has castle
     #rights kingside
     #
-    def getKingsideCastleMoves(self, r, c, moves, allyColor):
+    def getKingsideCastleMoves(self, r, c, moves, attackMap):
         #check if two squares between king and rook are not under attack
         if self.board[r][c+1] == '--' and self.board[r][c+2] == '--' and \
-            not self.squareUnderAttack(r, c+1, allyColor) and not self.squareUnderAttack(r, c+2, allyColor):
+            r * 8 + c + 1 not in attackMap and r * 8 + c + 2 not in attackMap:
                 moves.append(Move((r, c), (r, c+2), self.board, castle=True)) #isCastleMove=true same as castle =true
 
-    def getQueensideCastleMoves(self, r, c, moves, allyColor):
+    def getQueensideCastleMoves(self, r, c, moves, attackMap):
         #check if three squares between king and rook are not under attack
         if self.board[r][c-1] == '--' and self.board[r][c-2] == '--' and self.board[r][c-3] == '--' and \
-            not self.squareUnderAttack(r, c-1, allyColor) and not self.squareUnderAttack(r, c-2, allyColor):
+            r * 8 + c - 1 not in attackMap and r * 8 + c - 2 not in attackMap:
                 moves.append(Move((r, c), (r, c-2), self.board, castle=True))
+
+    '''
+    Returns the set of squares (row * 8 + col) the pieces of attackerColor attack. Sliding attacks go through the other
+    side's king, so the king can't step back along the line of a check
+    '''
+    def getAttackMap(self, attackerColor):
+        attacked = set()
+        board = self.board
+        defendingKing = ('b' if attackerColor == 'w' else 'w') + 'K'
+        pawnRowChange = -1 if attackerColor == 'w' else 1
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece[0] != attackerColor:
+                    continue
+                type = piece[1]
+                if type == 'p':
+                    endRow = r + pawnRowChange
+                    if 0 <= endRow < 8:
+                        if c > 0:
+                            attacked.add(endRow * 8 + c - 1)
+                        if c < 7:
+                            attacked.add(endRow * 8 + c + 1)
+                elif type == 'N':
+                    for endRow, endCol, m in knightTable[r][c]:
+                        attacked.add(endRow * 8 + endCol)
+                elif type == 'K':
+                    for endRow, endCol in kingTable[r][c]:
+                        attacked.add(endRow * 8 + endCol)
+                else:
+                    rays = rayTable[r][c]
+                    for j in pieceDirections[type]:
+                        for endRow, endCol in rays[j]:
+                            attacked.add(endRow * 8 + endCol)
+                            endPiece = board[endRow][endCol]
+                            if endPiece != "--" and endPiece != defendingKing:
+                                break
+        return attacked
+    '''
+    Returns the pieces of attackerColor attacking the square as a list of (row, col, direction from the square)
+    '''
+    def getAttackers(self, r, c, attackerColor):
+        attackers = []
+        board = self.board
+        rays = rayTable[r][c]
+        attackingTypes = rayAttackers[attackerColor]
+        for j in range(8):
+            nearTypes, farTypes = attackingTypes[j]
+            types = nearTypes #the next square can also hold a king or pawn attacker
+            for endRow, endCol in rays[j]:
+                endPiece = board[endRow][endCol]
+                if endPiece == "--":
+                    types = farTypes
+                    continue
+                if endPiece[0] == attackerColor and endPiece[1] in types:
+                    attackers.append((endRow, endCol, directions[j]))
+                break
+        knight = attackerColor + 'N'
+        for endRow, endCol, m in knightTable[r][c]:
+            if board[endRow][endCol] == knight:
+                attackers.append((endRow, endCol, m))
+        return attackers
+
     ''' #391
     Returns if the square is under attack
     '''
     def squareUnderAttack(self, r, c, allyColor):
         # check outward from the square
         enemyColor = 'w' if allyColor == 'b' else 'b'
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
-            for i in range(1, 8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor: #no attack from that direction
-                        break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        # 5 possiblities in this complex conditional
-                        # 1.) orthogonally and piece is rook
-                        # 2.) diagonally and piece is a bishop
-                        # 3.) 1 square away diagonally from square and piece is a pawn
-                        # 4.) any direction and piece is a queen
-                        # 5.) any direction 1 square away and pice is a king
-                        if (0 <= j <= 3 and type == 'R') or \
-                                (4 <= j <= 7 and type == 'B') or \
-                                (i == 1 and type == 'p' and (
-                                        (enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
-                                (type == 'Q') or (i == 1 and type == 'K'):
-                            return True
-                        else: #enemy piece not applying check:
-                            break
-                else:
-                    break #off board
-        #check for knight checks
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, 2), (1, -2), (2, -1), (2, 1))
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'N': #enemy knight attacking king
+        board = self.board
+        rays = rayTable[r][c]
+        attackingTypes = rayAttackers[enemyColor]
+        for j in range(8):
+            nearTypes, farTypes = attackingTypes[j]
+            types = nearTypes #1 square away a king, or a pawn from the right side, attacks as well
+            for endRow, endCol in rays[j]:
+                endPiece = board[endRow][endCol]
+                if endPiece == "--":
+                    types = farTypes
+                    continue
+                if endPiece[0] == enemyColor and endPiece[1] in types:
                     return True
-
+                break #any other piece blocks this direction
+        #check for knight checks
+        knight = enemyColor + 'N'
+        for endRow, endCol, m in knightTable[r][c]:
+            if board[endRow][endCol] == knight: #enemy knight attacking king
+                return True
         return False
 
     '''
@@ -529,53 +973,38 @@ class GameState():
             startRow = self.blackKingLocation[0]
             startCol = self.blackKingLocation[1]
         #check outward from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
+        board = self.board
+        rays = rayTable[startRow][startCol]
+        attackingTypes = rayAttackers[enemyColor]
+        for j in range(8):
             d = directions[j]
+            nearTypes, farTypes = attackingTypes[j]
+            types = nearTypes #1 square away a king, or a pawn from the right side, gives check as well
             possiblePin = () #reset possible pins
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != 'K':
-                        if possiblePin == (): #1st allied piece could be pinned
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else: #2nd allied piece, so no pin or check possible in this direction
-                            break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        #5 possiblities here in this complex conditional
-                        #1.) orthogonally away from king and piece is a rook
-                        #2.) diagonally away from king and piece is a bishop
-                        #3.) 1 square away diagonally from king and piece is a pawn
-                        #4.) any direction and piece is a queen
-                        #5.) any direction 1 square away and piece is a king (this is necessary to prevent a king move to square controlled by another king)
-                        if (0 <= j <= 3 and type == 'R') or \
-                                (4 <= j <= 7 and type == 'B') or \
-                                (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <=5))) or \
-                                (type == 'Q') or (i == 1 and type == 'K'):
-                            if possiblePin == (): #no piece blocking, so check
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else: #piece blocking so pin
-                                pins.append(possiblePin)
-                                break
-                        else: #enemy piece not applying check:
-                            break
-                else:
-                    break #off board
+            for endRow, endCol in rays[j]:
+                endPiece = board[endRow][endCol]
+                if endPiece == "--":
+                    types = farTypes
+                    continue
+                if endPiece[0] == allyColor and endPiece[1] != 'K':
+                    if possiblePin == (): #1st allied piece could be pinned
+                        possiblePin = (endRow, endCol, d[0], d[1])
+                        types = farTypes
+                        continue
+                    break #2nd allied piece, so no pin or check possible in this direction
+                if endPiece[0] == enemyColor and endPiece[1] in types:
+                    if possiblePin == (): #no piece blocking, so check
+                        inCheck = True
+                        checks.append((endRow, endCol, d[0], d[1]))
+                    else: #piece blocking so pin
+                        pins.append(possiblePin)
+                break #enemy piece not applying check
         #check for knight checks
-        knightMoves= ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'N': #enemy knight attacking king
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
+        knight = enemyColor + 'N'
+        for endRow, endCol, m in knightTable[startRow][startCol]:
+            if board[endRow][endCol] == knight: #enemy knight attacking king
+                inCheck = True
+                checks.append((endRow, endCol, m[0], m[1]))
         return inCheck, pins, checks
 
     def updateCastleRights(self, move):
@@ -598,8 +1027,8 @@ class GameState():
                 elif move.startCol == 7: #right rook
                     self.blackCastleKingside = False
 
-        #if a rook is captured
-        elif move.pieceCaptured == 'wR':
+        #if a rook is captured, checked separately since a rook or king move can capture one too
+        if move.pieceCaptured == 'wR':
             if move.endRow == 7:
                 if move.endCol == 0:
                     self.whiteCastleQueenside = False
@@ -612,12 +1041,36 @@ class GameState():
                 elif move.endCol == 7:
                     self.blackCastleKingside = False
 
-class CastleRights():
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+'''
+Compact copy of a position, cheap to take at every root move and to pickle for another process: the board as 64 bytes
+of piece codes plus what makeMove keeps besides the board. The logs aren't copied, moveCount and the zobrist key are
+enough for restore to find the snapshot on the line of the GameState it was taken from
+'''
+class PositionSnapshot():
+    __slots__ = ("squares", "whiteToMove", "castleRights", "enpassantPossible", "halfmoveClock", "fullmoveNumber",
+                 "zobristKey", "evaluation", "nonPawnMaterial", "moveCount")
+
+    def __init__(self, gs):
+        self.squares = bytes([pieceCodes[piece] for row in gs.board for piece in row])
+        self.whiteToMove = gs.whiteToMove
+        self.castleRights = gs.castleRightsBits()
+        self.enpassantPossible = gs.enpassantPossible
+        self.halfmoveClock = gs.halfmoveClock
+        self.fullmoveNumber = gs.fullmoveNumber
+        self.zobristKey = gs.zobristKey
+        self.evaluation = (gs.materialScore, gs.positionScore)
+        self.nonPawnMaterial = (gs.nonPawnMaterial["w"], gs.nonPawnMaterial["b"])
+        self.moveCount = len(gs.moveLog)
+
+    '''
+    Snapshots pickle as a plain tuple
+    '''
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
 
 class Move():
     # maps keys to values
@@ -628,21 +1081,44 @@ class Move():
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3,
                    "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
+    promotionPieces = "QRBN" #the first one is the default
+    #no per-move __dict__, the search creates a lot of these
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured", "isPawnPromotion",
+                 "promotionPiece", "isEnpassantMove", "castle", "isCapture", "moveID")
 
-    def __init__(self, startSq, endSq, board, isEnpassantMove=False, castle=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.isPawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7)
+    def __init__(self, startSq, endSq, board, isEnpassantMove=False, castle=False, promotionPiece='Q'):
+        self.startRow = startRow = startSq[0]
+        self.startCol = startCol = startSq[1]
+        self.endRow = endRow = endSq[0]
+        self.endCol = endCol = endSq[1]
+        self.pieceMoved = pieceMoved = board[startRow][startCol]
+        self.isPawnPromotion = (pieceMoved == 'wp' and endRow == 0) or (pieceMoved == 'bp' and endRow == 7)
+        self.promotionPiece = promotionPiece
         self.isEnpassantMove = isEnpassantMove
         self.castle = castle
-        if self.isEnpassantMove:
-            self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
+        if isEnpassantMove:
+            self.pieceCaptured = 'wp' if pieceMoved == 'bp' else 'bp'
+        else:
+            self.pieceCaptured = board[endRow][endCol]
         self.isCapture = self.pieceCaptured != "--"
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        #16 bit packed id: start square in bits 0-5, end square in bits 6-11, promotion piece in bits 12-13.
+        #The enpassant and castle flags aren't needed, they follow from the squares and the board
+        self.moveID = startRow * 8 + startCol | (endRow * 8 + endCol) << 6
+        if self.isPawnPromotion: #underpromotions get their own ids, a queen promotion keeps the plain one
+            self.moveID |= self.promotionPieces.index(promotionPiece) << 12
+
+    '''
+    Rebuilds the Move with the given moveID in the position on the board
+    '''
+    @classmethod
+    def fromMoveID(cls, moveID, board):
+        startRow, startCol = divmod(moveID & 63, 8)
+        endRow, endCol = divmod((moveID >> 6) & 63, 8)
+        pieceMoved = board[startRow][startCol]
+        isEnpassantMove = pieceMoved[1] == 'p' and startCol != endCol and board[endRow][endCol] == "--"
+        castle = pieceMoved[1] == 'K' and abs(endCol - startCol) == 2
+        return cls((startRow, startCol), (endRow, endCol), board, isEnpassantMove, castle, cls.promotionPieces[moveID >> 12])
+
     '''
     Overriding the equals method
     '''
@@ -651,9 +1127,15 @@ class Move():
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
     def getChessNotation(self):
         #add to this code to make real chess notation
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionPiece.lower()
+        return notation
 
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
@@ -668,15 +1150,13 @@ class Move():
         #pawn moves
         if self.pieceMoved[1] == 'p':
             if self.isCapture:
-                return self.colsToFiles[self.startCol] + "x" + endSquare
-            else:
-                return endSquare
-            
+                endSquare = self.colsToFiles[self.startCol] + "x" + endSquare
             #pawn promotions
-        
-        #two of the same tpye of piece moving to a square, Nbd2 if both knights can move to d2
+            if self.isPawnPromotion:
+                endSquare += "=" + self.promotionPiece
+            return endSquare
 
-        #also adding + for check move, and # for checkmate move
+        #disambiguation (Nbd2) and + / # need the position, ChessPgn.moveToSAN writes full SAN
 
         #piece moves
         moveString = self.pieceMoved[1]
@@ -4,7 +4,6 @@ This is our main driver file. It will be responsible for handling user input and
 
 import pygame as p
 import ChessEngine, ChessAi #enpassanting as former pin against another pin
-from multiprocessing import Process, Queue
 
 BOARD_WIDTH = BOARD_HEIGHT = 512
 MOVE_LOG_PANEL_WIDTH = 300
@@ -12,6 +11,7 @@ MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8 #dimensions of a chess board are 8x8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15 #for animations
+AI_WORKERS = 1 #more than 1 splits the AI's root moves across that many processes
 IMAGES = {}
 
 '''
@@ -44,7 +44,7 @@ def main():
     playerOne = False #IF a human is playing white, then this will be True. If an AI is playing, then false.
     playerTwo = False #^Same as aboe but for black
     AIThinking = False
-    moveFinderProcess = None
+    aiWorker = ChessAi.AiWorker(type(gs), AI_WORKERS) #searches in its own process, kept for the whole session
     moveUndone = False
     while running:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
@@ -85,7 +85,7 @@ def main():
                     animate = False
                     gameOver = False
                     if AIThinking:
-                        moveFinderProcess.terminate()
+                        aiWorker.stop()
                         AIThinking = False
                     moveUndone = True
 
@@ -98,7 +98,7 @@ def main():
                     animate = False
                     gameOver = False
                     if AIThinking:
-                        moveFinderProcess.terminate()
+                        aiWorker.stop()
                         AIThinking = False
                     moveUndone = True
 
@@ -107,13 +107,11 @@ def main():
             if not AIThinking:
                 AIThinking = True
                 print("thinking...")
-                returnQueue = Queue() #used to pass data between threads
-                moveFinderProcess = Process(target=ChessAi.findBestMove, args=(gs, validMoves, returnQueue))
-                moveFinderProcess.start() #call findBestMove(gs, validMoves, returnQueue)
+                aiWorker.go(gs) #only the moves made since its last search are sent over
 
-            if not moveFinderProcess.is_alive():
-                print("done thinking")
-                AIMove = returnQueue.get()
+            if aiWorker.poll():
+                print("done thinking:", aiWorker.lastStats)
+                AIMove = aiWorker.getMove(gs)
                 if AIMove is None:
                     AIMove = ChessAi.findRandomMove(validMoves)
                 gs.makeMove(AIMove)
@@ -137,6 +135,7 @@ def main():
 
         clock.tick(MAX_FPS)
         p.display.flip()
+    aiWorker.quit()
 
 '''
 Responsible for all the graphics within a current game state.
@@ -0,0 +1,167 @@
+"""
+Perft (performance test) driver. Counts every legal move sequence to a given depth from a FEN position and compares
+the counts to known reference values, which catches move generator bugs (en passant, castling, pins, promotions) and
+measures move generator speed in nodes per second. The compare mode plays random games and reports every position
+where getValidCaptures disagrees with the legal moves, or the incrementally kept hash and evaluation with the board.
+
+Usage: python ChessPerft.py [--depth N] [--fen FEN] [--divide]
+       python ChessPerft.py --compare [--games N] [--seed N]
+"""
+import argparse
+import random
+import sys
+import time
+import ChessEngine
+
+'''
+Reference positions and their known node counts for depth 1, 2, 3...
+'''
+PERFT_SUITE = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("enpassant", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("promotion", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("promotion2", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+DEFAULT_DEPTH = 3
+COMPARE_GAMES = 60
+COMPARE_PLIES = 200 #a random game is cut off after this many plies
+
+'''
+Counts the leaf nodes of the legal move tree, the last ply is counted from the move list without making the moves
+'''
+def perft(gs, depth):
+    moves = gs.getValidMoves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+'''
+Returns the node count below each root move as a list of (move notation, nodes)
+'''
+def divide(gs, depth):
+    counts = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts.append((move.getChessNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return counts
+
+'''
+Runs perft on one position for depth 1..depth, printing nodes, time and nodes/sec per depth.
+Returns False if a count differs from the expected one
+'''
+def runPosition(name, fen, expected, depth, showDivide):
+    print(name, fen)
+    passed = True
+    for d in range(1, depth + 1):
+        gs = ChessEngine.GameState.fromFEN(fen)
+        startTime = time.perf_counter()
+        if showDivide and d == depth:
+            counts = divide(gs, d)
+            nodes = sum(count for notation, count in counts)
+        else:
+            nodes = perft(gs, d)
+        elapsed = time.perf_counter() - startTime
+        result = ""
+        if expected is not None and d <= len(expected):
+            result = "ok" if nodes == expected[d - 1] else "FAIL expected " + str(expected[d - 1])
+            passed = passed and nodes == expected[d - 1]
+        print("  depth %d: %10d nodes %8.2fs %10.0f nodes/sec %s" % (d, nodes, elapsed, nodes / elapsed if elapsed > 0 else 0, result))
+        if showDivide and d == depth:
+            for notation, count in sorted(counts):
+                print("    %s: %d" % (notation, count))
+    return passed
+
+'''
+The moves getValidCaptures should give: every legal move when in check, else the captures and promotions
+'''
+def expectedCaptures(moves, inCheck):
+    return {move.moveID for move in moves if inCheck or move.isCapture or move.isPawnPromotion}
+
+'''
+Checks one position for what perft can't see: getValidCaptures against the legal moves, and the zobrist key and
+evaluation makeMove/undoMove keep up to date against the ones computed from the board. Returns a list of what
+differs, empty if nothing does
+'''
+def comparePosition(gs):
+    problems = []
+    moves = gs.getValidMoves()
+    expected = expectedCaptures(moves, gs.inCheck)
+    captures = gs.getValidCaptures()
+    if {move.moveID for move in captures} != expected or len(captures) != len(expected):
+        problems.append("captures: " + " ".join(sorted(move.getChessNotation() for move in captures)))
+    if gs.zobristKey != gs.computeZobristKey():
+        problems.append("zobrist key differs from the board's")
+    if (gs.materialScore, gs.positionScore) != gs.computeEvaluation() or gs.nonPawnMaterial != gs.computeNonPawnMaterial():
+        problems.append("evaluation differs from the board's")
+    return problems
+
+'''
+Plays random games comparing every position, then takes every move back checking each position comes back the same.
+Prints each position that differs, returns how many did
+'''
+def compareGames(games, seed):
+    random.seed(seed)
+    mismatches = 0
+    positions = 0
+    for game in range(games):
+        gs = ChessEngine.GameState()
+        played = []
+        for ply in range(COMPARE_PLIES):
+            problems = comparePosition(gs)
+            positions += 1
+            if problems:
+                mismatches += 1
+                print("game %d ply %d %s" % (game + 1, ply, gs.toFEN()))
+                for problem in problems:
+                    print("  " + problem)
+            moves = gs.getValidMoves()
+            if len(moves) == 0:
+                break
+            played.append((gs.toFEN(), gs.zobristKey))
+            gs.makeMove(random.choice(moves))
+        while gs.moveLog:
+            gs.undoMove()
+            fen, zobristKey = played.pop()
+            if gs.toFEN() != fen or gs.zobristKey != zobristKey:
+                mismatches += 1
+                print("game %d undo differs: %s / %s" % (game + 1, gs.toFEN(), fen))
+                break
+    print("%d games, %d positions compared, %d mismatches" % (games, positions, mismatches))
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft move generator test and benchmark")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH)
+    parser.add_argument("--fen", help="run one position instead of the reference suite")
+    parser.add_argument("--divide", action="store_true", help="show the node count under each root move at the last depth")
+    parser.add_argument("--compare", action="store_true", help="check random games position by position instead")
+    parser.add_argument("--games", type=int, default=COMPARE_GAMES, help="random games to check")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.compare:
+        return 0 if compareGames(args.games, args.seed) == 0 else 1
+    if args.fen:
+        positions = [("fen", args.fen, None)]
+    else:
+        positions = PERFT_SUITE
+    passed = True
+    for name, fen, expected in positions:
+        passed = runPosition(name, fen, expected, args.depth, args.divide) and passed
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
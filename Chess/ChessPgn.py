@@ -0,0 +1,297 @@
+"""
+SAN (standard algebraic notation) and PGN support. moveToSAN writes a move the way PGN files do, with the
+disambiguation, promotion piece and check or mate sign, and parseSAN reads one back. readGames streams the games of a
+PGN file of any size one at a time, only the game being read is kept. gamePgn writes a GameState's moveLog as PGN.
+Replaying SAN finds the piece that can make each move from the board instead of generating every legal move, legal
+moves are only looked at to tell apart pieces of the same kind that can reach the same square, which makes replaying
+large archives fast.
+
+Usage: python ChessPgn.py games.pgn [--validate]   (replays every game and reports moves per minute)
+"""
+import argparse
+import re
+import sys
+import time
+import ChessEngine
+
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result") #written first, "?" when not given
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+LINE_LENGTH = 79 #PGN export format keeps movetext lines under 80 characters
+CASTLES = {"O-O": 2, "0-0": 2, "O-O-O": -2, "0-0-0": -2} #how far the king moves
+sanPattern = re.compile(r"([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?")
+tagPattern = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+#a brace comment (cut off at the end of the line if it goes on), a rest of line comment, a variation bracket or a word
+tokenPattern = re.compile(r"\{[^}]*\}?|;.*|[()]|[^\s{};()]+")
+moveNumberPattern = re.compile(r"^\d+\.*")
+
+'''
+Start squares of the pieces of the side to move of the given kind ('N', 'B', 'R', 'Q' or 'K') that reach
+(endRow, endCol), pins not taken into account
+'''
+def pieceOrigins(gs, pieceType, endRow, endCol):
+    piece = ('w' if gs.whiteToMove else 'b') + pieceType
+    board = gs.board
+    if pieceType == 'N':
+        return [(r, c) for r, c, m in ChessEngine.knightTable[endRow][endCol] if board[r][c] == piece]
+    if pieceType == 'K':
+        return [(r, c) for r, c in ChessEngine.kingTable[endRow][endCol] if board[r][c] == piece]
+    origins = []
+    rays = ChessEngine.rayTable[endRow][endCol]
+    for j in ChessEngine.pieceDirections[pieceType]:
+        for r, c in rays[j]:
+            if board[r][c] != "--":
+                if board[r][c] == piece:
+                    origins.append((r, c))
+                break
+    return origins
+
+'''
+Returns if the move doesn't leave the mover's own king in check
+'''
+def isLegal(gs, move):
+    gs.makeMove(move)
+    row, col = gs.blackKingLocation if gs.whiteToMove else gs.whiteKingLocation
+    legal = not gs.squareUnderAttack(row, col, 'b' if gs.whiteToMove else 'w')
+    gs.undoMove()
+    return legal
+
+'''
+Builds the Move a SAN string stands for in the position of gs, from the board alone. Only when two pieces of the same
+kind can reach the square are the pins looked at, otherwise the move is trusted to be legal as it came from a game.
+Raises ValueError for text that isn't SAN or fits no piece
+'''
+def sanToMove(gs, san):
+    text = san.rstrip("+#!?")
+    board = gs.board
+    if text in CASTLES:
+        row, col = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+        return ChessEngine.Move((row, col), (row, col + CASTLES[text]), board, castle=True)
+    match = sanPattern.fullmatch(text)
+    if match is None:
+        raise ValueError("not a SAN move: " + san)
+    pieceType, fromFile, fromRank, endSquare, promotion = match.groups()
+    endRow = ChessEngine.Move.ranksToRows[endSquare[1]]
+    endCol = ChessEngine.Move.filesToCols[endSquare[0]]
+    if pieceType is None: #pawn move
+        step = 1 if gs.whiteToMove else -1 #rows toward the side to move's own back rank
+        pawn = 'wp' if gs.whiteToMove else 'bp'
+        if fromFile is not None: #capture
+            startSq = (endRow + step, ChessEngine.Move.filesToCols[fromFile])
+        elif 0 <= endRow + step < 8 and board[endRow + step][endCol] == pawn:
+            startSq = (endRow + step, endCol)
+        else: #2 square advance
+            startSq = (endRow + 2 * step, endCol)
+        if not (0 <= startSq[0] < 8 and board[startSq[0]][startSq[1]] == pawn):
+            raise ValueError("no pawn can play " + san)
+        isEnpassantMove = fromFile is not None and board[endRow][endCol] == "--"
+        return ChessEngine.Move(startSq, (endRow, endCol), board, isEnpassantMove=isEnpassantMove,
+                                promotionPiece=promotion.upper() if promotion else 'Q')
+    moves = [ChessEngine.Move((r, c), (endRow, endCol), board) for r, c in pieceOrigins(gs, pieceType, endRow, endCol)
+             if (fromFile is None or ChessEngine.Move.colsToFiles[c] == fromFile) and
+             (fromRank is None or ChessEngine.Move.rowsToRanks[r] == fromRank)]
+    if len(moves) > 1:
+        moves = [move for move in moves if isLegal(gs, move)]
+    if len(moves) != 1:
+        raise ValueError(("ambiguous move " if moves else "no piece can play ") + san)
+    return moves[0]
+
+'''
+Like sanToMove, but also checks the move is one of the legal moves, validMoves is generated if not given
+'''
+def parseSAN(gs, san, validMoves=None):
+    move = sanToMove(gs, san)
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    for validMove in validMoves:
+        if validMove.moveID == move.moveID:
+            return validMove
+    raise ValueError("illegal move " + san)
+
+'''
+SAN of a legal move in the position of gs before it is made: Nbd7, exd5, e8=Q, O-O, with + for check and # for mate
+'''
+def moveToSAN(gs, move):
+    endSquare = move.getRankFile(move.endRow, move.endCol)
+    if move.castle:
+        san = "O-O" if move.endCol > move.startCol else "O-O-O"
+    elif move.pieceMoved[1] == 'p':
+        san = (move.colsToFiles[move.startCol] + 'x' if move.isCapture else "") + endSquare
+        if move.isPawnPromotion:
+            san += '=' + move.promotionPiece
+    else:
+        pieceType = move.pieceMoved[1]
+        others = [(r, c) for r, c in pieceOrigins(gs, pieceType, move.endRow, move.endCol) if (r, c) != (move.startRow, move.startCol)
+                  and isLegal(gs, ChessEngine.Move((r, c), (move.endRow, move.endCol), gs.board))]
+        disambiguation = ""
+        if others:
+            if all(c != move.startCol for r, c in others):
+                disambiguation = move.colsToFiles[move.startCol]
+            elif all(r != move.startRow for r, c in others):
+                disambiguation = move.rowsToRanks[move.startRow]
+            else:
+                disambiguation = move.getRankFile(move.startRow, move.startCol)
+        san = pieceType + disambiguation + ('x' if move.isCapture else "") + endSquare
+    #getValidMoves sets these for the position after the move, they are put back for the one gs is left in
+    saved = (gs.inCheck, gs.pins, gs.checks, gs.checkMate, gs.staleMate)
+    gs.makeMove(move)
+    row, col = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+    if gs.squareUnderAttack(row, col, 'w' if gs.whiteToMove else 'b'):
+        san += '#' if len(gs.getValidMoves()) == 0 else '+'
+    gs.undoMove()
+    gs.inCheck, gs.pins, gs.checks, gs.checkMate, gs.staleMate = saved
+    return san
+
+'''
+Makes the SAN moves on gs one after the other and returns gs. With validate every move is checked against the legal
+moves, otherwise they are trusted and only the moving piece is looked for
+'''
+def replayMoves(gs, moves, validate=False):
+    for san in moves:
+        gs.makeMove(parseSAN(gs, san) if validate else sanToMove(gs, san))
+    return gs
+
+class PgnGame():
+
+    def __init__(self, headers, moves, result):
+        self.headers = headers #tag pairs in the order they were read
+        self.moves = moves #SAN of the main line, comments, annotations and variations left out
+        self.result = result if result is not None else headers.get("Result", "*")
+
+    '''
+    The GameState the game starts from, set up from the FEN tag if there is one
+    '''
+    def startState(self):
+        fen = self.headers.get("FEN")
+        return ChessEngine.GameState.fromFEN(fen) if fen else ChessEngine.GameState()
+
+    '''
+    Plays the game's moves and returns the GameState at the end
+    '''
+    def replay(self, validate=False):
+        return replayMoves(self.startState(), self.moves, validate)
+
+'''
+Splits the lines of a PGN file into tag pairs, given as (name, value), and movetext tokens. Comments are dropped,
+brace comments can span lines
+'''
+def pgnTokens(lines):
+    inComment = False
+    for line in lines:
+        if inComment:
+            end = line.find('}')
+            if end < 0:
+                continue
+            line = line[end + 1:]
+            inComment = False
+        elif line.startswith('%'): #escaped line
+            continue
+        elif line.lstrip().startswith('['):
+            match = tagPattern.match(line.strip())
+            if match is not None:
+                yield match.group(1), match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+                continue
+        for match in tokenPattern.finditer(line):
+            token = match.group()
+            if token[0] == '{':
+                inComment = not token.endswith('}')
+            elif token[0] != ';':
+                yield token
+
+'''
+Generator of the PgnGames in a PGN file, given as a path or an open text file. Games are read lazily, so files of
+any size can be gone through game by game
+'''
+def readGames(source):
+    if isinstance(source, str):
+        with open(source, encoding="utf-8", errors="replace") as file:
+            yield from readGames(file)
+        return
+    headers, moves, result = {}, [], None
+    inMovetext = False
+    variationDepth = 0
+    for token in pgnTokens(source):
+        if isinstance(token, tuple): #a tag after movetext starts the next game, even if the last one had no result
+            if inMovetext:
+                yield PgnGame(headers, moves, result)
+                headers, moves, result = {}, [], None
+                inMovetext = False
+                variationDepth = 0
+            headers[token[0]] = token[1]
+            continue
+        inMovetext = True
+        if token == '(':
+            variationDepth += 1
+        elif token == ')':
+            variationDepth = max(0, variationDepth - 1)
+        elif variationDepth > 0 or token[0] == '$': #moves of a variation or a numeric annotation
+            continue
+        elif token in RESULTS:
+            yield PgnGame(headers, moves, token)
+            headers, moves, result = {}, [], None
+            inMovetext = False
+        else:
+            token = moveNumberPattern.sub("", token) #1.e4 and 12... come as one token
+            if token:
+                moves.append(token)
+    if inMovetext or headers:
+        yield PgnGame(headers, moves, result)
+
+'''
+PGN text of the game in gs's moveLog, played from gs.startFEN. headers is a list of (name, value) pairs or a dict,
+the seven tag roster comes first with "?" for the tags it leaves out
+'''
+def gamePgn(gs, result="*", headers=()):
+    tags = dict(headers)
+    tags["Result"] = result
+    if gs.startFEN is not None:
+        tags["SetUp"] = "1"
+        tags["FEN"] = gs.startFEN
+    names = list(SEVEN_TAG_ROSTER) + [name for name in tags if name not in SEVEN_TAG_ROSTER]
+    text = "".join('[%s "%s"]\n' % (name, str(tags.get(name, "?")).replace('\\', '\\\\').replace('"', '\\"'))
+                   for name in names) + "\n"
+    board = ChessEngine.GameState.fromFEN(gs.startFEN) if gs.startFEN is not None else ChessEngine.GameState()
+    tokens = []
+    for move in gs.moveLog:
+        if board.whiteToMove:
+            tokens.append(str(board.fullmoveNumber) + ".")
+        elif not tokens: #the game starts with black to move
+            tokens.append(str(board.fullmoveNumber) + "...")
+        tokens.append(moveToSAN(board, move))
+        board.makeMove(move)
+    tokens.append(result)
+    lines = []
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return text + "\n".join(lines) + "\n\n"
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay every game of a PGN file")
+    parser.add_argument("pgn", help="PGN file to replay")
+    parser.add_argument("--validate", action="store_true", help="check every move against the legal moves")
+    args = parser.parse_args()
+    games = 0
+    moves = 0
+    failed = 0
+    startTime = time.perf_counter()
+    for i, game in enumerate(readGames(args.pgn)):
+        try:
+            game.replay(args.validate)
+        except ValueError as error:
+            print("game %d: %s" % (i + 1, error))
+            failed += 1
+            continue
+        games += 1
+        moves += len(game.moves)
+    elapsed = time.perf_counter() - startTime
+    print("%d games, %d moves, %d failed, %.2fs, %.0f moves/min" % (games, moves, failed, elapsed,
+          moves / elapsed * 60 if elapsed > 0 else 0))
+    return 0 if failed == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Syzygy endgame tablebase probing. The WDL (win/draw/loss) and DTZ (distance to the next capture or pawn move) tables
+are read through python-chess's chess.syzygy, which memory-maps the .rtbw/.rtbz files of the configured directory. It
+is an optional dependency: without it, or without table files, every probe just answers None and the AI searches as
+usual. Probe results are kept in an LRU cache keyed by the zobrist key, the search hits the same endgame positions
+over and over.
+"""
+import os
+from collections import OrderedDict
+try:
+    import chess
+    import chess.syzygy
+except ImportError:
+    chess = None
+
+MAX_PIECES = 5 #kings included, the largest tables probed
+CACHE_SIZE = 65536 #probe results kept
+WIN = 2 #WDL values as Syzygy gives them, from the side to move's point of view
+CURSED_WIN = 1 #a win that the fifty move rule turns into a draw
+DRAW = 0
+BLESSED_LOSS = -1
+LOSS = -2
+
+'''
+Number of pieces on the board, kings included
+'''
+def pieceCount(gs):
+    return 64 - sum(row.count("--") for row in gs.board)
+
+class Tablebase():
+
+    '''
+    directory can be None or hold no tables, every probe then answers None. The tables are opened on the first probe
+    '''
+    def __init__(self, directory, cacheSize=CACHE_SIZE):
+        self.directory = directory
+        self.cacheSize = cacheSize
+        self.tables = None
+        self.loaded = False
+        self.wdlCache = OrderedDict()
+        self.dtzCache = OrderedDict()
+
+    def load(self):
+        self.loaded = True
+        if chess is None or self.directory is None or not os.path.isdir(self.directory):
+            return
+        tables = chess.syzygy.open_tablebase(self.directory)
+        if len(tables.wdl) > 0:
+            self.tables = tables
+        else:
+            tables.close()
+
+    def close(self):
+        if self.tables is not None:
+            self.tables.close()
+        self.tables = None
+        self.loaded = False
+        self.wdlCache.clear()
+        self.dtzCache.clear()
+
+    '''
+    True if the position is small enough to probe and there are tables to probe it with. Castling rights aren't in
+    the tables
+    '''
+    def covers(self, gs):
+        if not self.loaded:
+            self.load()
+        return self.tables is not None and pieceCount(gs) <= MAX_PIECES and not (gs.whiteCastleKingside or
+            gs.whiteCastleQueenside or gs.blackCastleKingside or gs.blackCastleQueenside)
+
+    '''
+    Looks the position up in cache, else in the tables with probeFunction. None if the tables don't have it
+    '''
+    def cachedProbe(self, gs, cache, probeFunction):
+        key = (gs.zobristKey, gs.halfmoveClock) if cache is self.dtzCache else gs.zobristKey
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        try:
+            result = probeFunction(chess.Board(gs.toFEN()))
+        except (KeyError, chess.syzygy.MissingTableError): #a material combination the directory has no table for
+            result = None
+        cache[key] = result
+        if len(cache) > self.cacheSize:
+            cache.popitem(last=False)
+        return result
+
+    '''
+    WIN, CURSED_WIN, DRAW, BLESSED_LOSS or LOSS for the side to move, None if the position can't be probed. WDL
+    assumes the fifty move counter was just reset, so it is exact right after a capture or pawn move
+    '''
+    def probeWDL(self, gs):
+        if not self.covers(gs):
+            return None
+        return self.cachedProbe(gs, self.wdlCache, self.tables.probe_wdl)
+
+    '''
+    Plies to the next capture or pawn move with best play, positive if the side to move wins and negative if it
+    loses, 0 for a draw. None if the position can't be probed
+    '''
+    def probeDTZ(self, gs):
+        if not self.covers(gs):
+            return None
+        return self.cachedProbe(gs, self.dtzCache, self.tables.probe_dtz)
+
+    '''
+    The move to play at the root, None if the position can't be probed. Keeps the best result the tables allow and
+    then, when winning, heads for the quickest capture or pawn move so the fifty move rule can't take the win away.
+    When losing it holds out as long as possible. The children's move generation sets inCheck, pins, checks,
+    checkMate and staleMate, they are put back for the root, which the search goes on to use if this returns None
+    '''
+    def bestMove(self, gs, validMoves):
+        if len(validMoves) == 0 or not self.covers(gs):
+            return None
+        saved = (gs.inCheck, gs.pins, gs.checks, gs.checkMate, gs.staleMate)
+        try:
+            return self.rankMoves(gs, validMoves)
+        finally:
+            gs.inCheck, gs.pins, gs.checks, gs.checkMate, gs.staleMate = saved
+
+    def rankMoves(self, gs, validMoves):
+        bestMove = None
+        bestRank = None
+        for move in validMoves:
+            gs.makeMove(move)
+            if len(gs.getValidMoves()) == 0 and gs.inCheck: #checkmate, nothing beats it
+                gs.undoMove()
+                return move
+            wdl = self.probeWDL(gs)
+            dtz = self.probeDTZ(gs)
+            gs.undoMove()
+            if wdl is None or dtz is None:
+                return None
+            #wdl and dtz are the opponent's. Their worst result first, then their largest dtz: when they lose that is the
+            #one closest to 0 from below, when they win the longest way there
+            rank = (-wdl, dtz)
+            if bestRank is None or rank > bestRank:
+                bestRank = rank
+                bestMove = move
+        return bestMove
@@ -0,0 +1,213 @@
+"""
+Texel-style tuner for the evaluation weights. Reads a corpus of labelled positions (a FEN and the result of the game
+it came from), and adjusts ChessAi.pieceScore and the piece position tables so that a logistic curve of the static
+evaluation predicts the results as well as possible (lowest cross entropy). The evaluation is linear in the weights,
+so the positions are scored and the gradient summed with ChessVectorEval in batches, split over a pool of processes.
+The tuned weights are written as a parameter file ChessAi loads at import. Quiet positions (nothing hanging, not in
+check) make the best corpus, the static evaluation can't see tactics.
+
+Usage: python ChessTuner.py corpus.epd [--output evaluation.json] [--iterations N] [--rate R] [--workers N] [--limit N]
+Each line holds a FEN followed by the result: 1-0, 0-1, 1/2-1/2, [1.0], [0.5], [0.0] or an EPD c9 "1-0"; opcode
+"""
+import argparse
+import math
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine, ChessAi, ChessVectorEval
+
+np = ChessVectorEval.np
+
+PIECES = "pNBRQK" #weight order, the same order the piece codes of each color are in
+TABLE_KEYS = {"p": "wp", "N": "N", "B": "B", "R": "R", "Q": "Q", "K": "wK"} #piecePositionScores table seen from white's side
+MIRRORED_KEYS = {"p": "bp", "K": "bK"} #tables black has of its own, written as upside down copies of white's
+DEFAULT_ITERATIONS = 500
+DEFAULT_RATE = 2.0 #centipawns, how far one Adam step may move a weight
+SHARD_SIZE = 100000 #positions per worker task
+SCALE_RANGE = (0.1, 4.0) #scale factors tried for the logistic curve
+SCALE_STEPS = 30 #golden section steps fitting the scale
+REPORT_EVERY = 25 #iterations between progress lines
+RESULTS = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}
+resultPattern = re.compile(r'(1-0|0-1|1/2-1/2)|\[\s*([01](?:\.\d*)?)\s*\]')
+
+tunerShards = None #(positions, results) arrays of every shard, set in each worker process
+
+'''
+Reads the corpus into an (N, 64) int8 array of piece codes and an array of results for white (1, 0.5 or 0).
+Lines without a result or with a broken FEN are counted and skipped
+'''
+def loadCorpus(path, limit=None):
+    boards = bytearray()
+    results = []
+    skipped = 0
+    with open(path) as file:
+        for line in file:
+            match = resultPattern.search(line)
+            if match is None:
+                skipped += 1
+                continue
+            try:
+                boards += ChessVectorEval.squaresFromFEN(line)
+            except (ValueError, KeyError):
+                skipped += 1
+                continue
+            results.append(RESULTS[match.group(1)] if match.group(1) else float(match.group(2)))
+            if limit is not None and len(results) >= limit:
+                break
+    positions = np.frombuffer(bytes(boards), dtype=np.int8).reshape(len(results), 64)
+    return positions, np.array(results), skipped
+
+'''
+Index arrays that turn the weight vector into the (13, 64) table ChessVectorEval scores with: the material weight and
+position weight each piece code on each square uses, and its sign. Weights are the 6 piece values in centipawns, then
+64 position values per piece from white's side, black reads them with the rows flipped
+'''
+def weightIndexes():
+    materialIndexes = np.zeros(len(ChessEngine.pieceNames), dtype=np.int64)
+    positionIndexes = np.zeros((len(ChessEngine.pieceNames), 64), dtype=np.int64)
+    signs = np.zeros(len(ChessEngine.pieceNames))
+    for code, piece in enumerate(ChessEngine.pieceNames):
+        if piece == "--":
+            continue
+        kind = PIECES.index(piece[1])
+        white = piece[0] == 'w'
+        materialIndexes[code] = kind
+        positionIndexes[code] = [len(PIECES) + kind * 64 + (square if white else square ^ 56) for square in range(64)]
+        signs[code] = 1 if white else -1
+    return materialIndexes, positionIndexes, signs
+
+def squareWeights(parameters, indexes):
+    materialIndexes, positionIndexes, signs = indexes
+    return signs[:, None] * (parameters[materialIndexes][:, None] + parameters[positionIndexes])
+
+'''
+The (13, 64) gradient of squareWeights turned back into the gradient of the weight vector
+'''
+def parameterGradient(squareGradient, indexes, size):
+    materialIndexes, positionIndexes, signs = indexes
+    signed = signs[:, None] * squareGradient
+    return np.bincount(materialIndexes, weights=signed.sum(axis=1), minlength=size) + \
+        np.bincount(positionIndexes.ravel(), weights=signed.ravel(), minlength=size)
+
+'''
+The weight vector of the weights ChessAi plays with now
+'''
+def currentParameters():
+    parameters = np.zeros(len(PIECES) * 65)
+    for kind, piece in enumerate(PIECES):
+        parameters[kind] = ChessAi.pieceScore[piece] * ChessAi.CENTIPAWNS_PER_PAWN
+        table = np.array(ChessAi.piecePositionScores[TABLE_KEYS[piece]], dtype=np.float64).ravel()
+        parameters[len(PIECES) + kind * 64:len(PIECES) + (kind + 1) * 64] = table * ChessAi.POSITION_SCORE_WEIGHT
+    return parameters
+
+'''
+Makes a weight vector ChessAi's weights, rounded to what the parameter file keeps
+'''
+def applyParameters(parameters):
+    for kind, piece in enumerate(PIECES):
+        if piece != 'K': #the kings are always on the board, their value can't be learned
+            ChessAi.pieceScore[piece] = round(parameters[kind] / ChessAi.CENTIPAWNS_PER_PAWN, 2)
+        table = parameters[len(PIECES) + kind * 64:len(PIECES) + (kind + 1) * 64] / ChessAi.POSITION_SCORE_WEIGHT
+        rows = [[round(score, 1) for score in table[r * 8:r * 8 + 8]] for r in range(8)]
+        ChessAi.piecePositionScores[TABLE_KEYS[piece]] = rows
+        if piece in MIRRORED_KEYS:
+            ChessAi.piecePositionScores[MIRRORED_KEYS[piece]] = rows[::-1]
+    ChessAi.updateEvaluationTables()
+
+def initTunerWorker(shards):
+    global tunerShards
+    tunerShards = shards
+
+'''
+Task run by the pool workers: cross entropy summed over one shard, and its gradient for the (13, 64) weights.
+The predicted score for white is 1 / (1 + 10 ** (-scale * evaluation / 400))
+'''
+def shardLoss(shardIndex, weights, scale):
+    positions, results = tunerShards[shardIndex]
+    evaluation = ChessVectorEval.scorePositions(positions, weights)
+    predicted = 1 / (1 + np.power(10.0, -scale * evaluation / 400))
+    predicted = np.clip(predicted, 1e-12, 1 - 1e-12)
+    loss = -np.sum(results * np.log(predicted) + (1 - results) * np.log(1 - predicted))
+    gradient = ChessVectorEval.squareWeightSums(positions, (predicted - results) * scale * math.log(10) / 400)
+    return loss, gradient
+
+'''
+Mean cross entropy of the whole corpus and its (13, 64) gradient, the shards scored in parallel
+'''
+def corpusLoss(pool, shardCount, positionCount, weights, scale):
+    totalLoss = 0.0
+    totalGradient = np.zeros(weights.shape)
+    for loss, gradient in pool.map(shardLoss, range(shardCount), [weights] * shardCount, [scale] * shardCount):
+        totalLoss += loss
+        totalGradient += gradient
+    return totalLoss / positionCount, totalGradient / positionCount
+
+'''
+Golden section search for the scale of the logistic curve that fits the current weights best, so the tuning only
+changes what the weights say and not how sure the curve is
+'''
+def fitScale(pool, shardCount, positionCount, weights):
+    low, high = SCALE_RANGE
+    ratio = (math.sqrt(5) - 1) / 2
+    for i in range(SCALE_STEPS):
+        left = high - ratio * (high - low)
+        right = low + ratio * (high - low)
+        if corpusLoss(pool, shardCount, positionCount, weights, left)[0] < corpusLoss(pool, shardCount, positionCount, weights, right)[0]:
+            high = right
+        else:
+            low = left
+    return (low + high) / 2
+
+'''
+Tunes the weights with Adam on the full corpus gradient, returns (start loss, end loss, scale)
+'''
+def tune(positions, results, iterations=DEFAULT_ITERATIONS, rate=DEFAULT_RATE, workers=os.cpu_count() or 1):
+    shards = [(positions[start:start + SHARD_SIZE], results[start:start + SHARD_SIZE]) for start in range(0, len(results), SHARD_SIZE)]
+    indexes = weightIndexes()
+    parameters = currentParameters()
+    firstMoment = np.zeros(len(parameters))
+    secondMoment = np.zeros(len(parameters))
+    beta1, beta2 = 0.9, 0.999
+    startTime = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initTunerWorker, initargs=(shards,)) as pool:
+        scale = fitScale(pool, len(shards), len(results), squareWeights(parameters, indexes))
+        startLoss = corpusLoss(pool, len(shards), len(results), squareWeights(parameters, indexes), scale)[0]
+        print("%d positions, scale %.3f, start loss %.6f" % (len(results), scale, startLoss))
+        for iteration in range(1, iterations + 1):
+            loss, squareGradient = corpusLoss(pool, len(shards), len(results), squareWeights(parameters, indexes), scale)
+            gradient = parameterGradient(squareGradient, indexes, len(parameters))
+            firstMoment = beta1 * firstMoment + (1 - beta1) * gradient
+            secondMoment = beta2 * secondMoment + (1 - beta2) * gradient * gradient
+            step = firstMoment / (1 - beta1 ** iteration) / (np.sqrt(secondMoment / (1 - beta2 ** iteration)) + 1e-12)
+            parameters -= rate * step
+            if iteration % REPORT_EVERY == 0:
+                print("iteration %d: loss %.6f, %.1fs" % (iteration, loss, time.time() - startTime))
+        endLoss = corpusLoss(pool, len(shards), len(results), squareWeights(parameters, indexes), scale)[0]
+    applyParameters(parameters)
+    return startLoss, endLoss, scale
+
+def main():
+    parser = argparse.ArgumentParser(description="Texel-style evaluation tuner")
+    parser.add_argument("corpus", help="file of FEN positions labelled with their game result")
+    parser.add_argument("--output", default=ChessAi.EVALUATION_PATH, help="parameter file to write")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Adam step size in centipawns")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--limit", type=int, help="only read this many positions")
+    args = parser.parse_args()
+    ChessVectorEval.requireNumpy()
+    positions, results, skipped = loadCorpus(args.corpus, args.limit)
+    if skipped:
+        print("skipped %d lines without a result or a valid FEN" % skipped)
+    if len(results) == 0:
+        print("no positions to tune on")
+        return 1
+    startLoss, endLoss, scale = tune(positions, results, args.iterations, args.rate, args.workers)
+    ChessAi.saveEvaluation(args.output)
+    print("loss %.6f -> %.6f, weights written to %s" % (startLoss, endLoss, args.output))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
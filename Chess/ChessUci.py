@@ -0,0 +1,209 @@
+"""
+Headless UCI front end, so the engine can be run by tournament managers and GUIs that speak the UCI protocol.
+Reads commands on stdin and answers on stdout, the search runs in a thread so "stop" and "isready" are answered while
+it thinks. Doesn't import pygame.
+
+Usage: python ChessUci.py
+"""
+import queue
+import sys
+import threading
+import ChessEngine, ChessAi, ChessBook, ChessTablebase
+
+ENGINE_NAME = "PlayableChess_AI"
+ENGINE_AUTHOR = "Roaringcows"
+DEFAULT_MOVES_TO_GO = 30 #moves the remaining clock time is spread over when the GUI doesn't say
+MOVE_OVERHEAD = 0.05 #seconds kept back per move for communication delays
+MIN_HASH_MB = 1
+MAX_HASH_MB = 1024
+
+'''
+Sends one line to the GUI
+'''
+def send(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+'''
+Converts a score from the side to move's point of view into the UCI "score cp x" or "score mate n" text. A mate
+scores CHECKMATE minus the plies to it, n counts full moves
+'''
+def uciScore(score):
+    if abs(score) > ChessAi.TABLEBASE_WIN:
+        moves = (ChessAi.CHECKMATE - abs(score) + 1) // 2
+        return "mate " + str(moves if score > 0 else -moves)
+    return "cp " + str(score)
+
+class UciEngine():
+
+    def __init__(self):
+        self.gs = ChessEngine.GameState()
+        self.searchThread = None
+        self.stopEvent = threading.Event()
+        self.table = ChessAi.TranspositionTable()
+        self.bookPath = ChessAi.BOOK_PATH
+        self.ownBook = True
+        self.book = ChessBook.OpeningBook(self.bookPath)
+        self.tablebase = ChessTablebase.Tablebase(ChessAi.TABLEBASE_DIRECTORY)
+
+    '''
+    Handles one line of input, returns False once the GUI sent "quit"
+    '''
+    def handle(self, line):
+        tokens = line.split()
+        if len(tokens) == 0:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            send("id name " + ENGINE_NAME)
+            send("id author " + ENGINE_AUTHOR)
+            send("option name Hash type spin default %d min %d max %d" % (ChessAi.TT_SIZE_MB, MIN_HASH_MB, MAX_HASH_MB))
+            send("option name OwnBook type check default true")
+            send("option name BookFile type string default " + self.bookPath)
+            send("option name SyzygyPath type string default " + ChessAi.TABLEBASE_DIRECTORY)
+            send("uciok")
+        elif command == "isready":
+            send("readyok")
+        elif command == "setoption":
+            self.setOption(tokens[1:])
+        elif command == "ucinewgame":
+            self.stop()
+            self.table.clear()
+        elif command == "position":
+            self.stop()
+            self.setPosition(tokens[1:])
+        elif command == "go":
+            self.stop()
+            self.go(tokens[1:])
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            return False
+        return True
+
+    '''
+    setoption name Hash value <MB>, OwnBook value <true|false>, BookFile value <path> or SyzygyPath value <directory>,
+    unknown options are ignored
+    '''
+    def setOption(self, tokens):
+        if "name" not in tokens or "value" not in tokens:
+            return
+        name = " ".join(tokens[tokens.index("name") + 1:tokens.index("value")])
+        value = " ".join(tokens[tokens.index("value") + 1:])
+        if name.lower() == "hash":
+            try:
+                sizeMB = min(MAX_HASH_MB, max(MIN_HASH_MB, int(value)))
+            except ValueError: #not a number, the option is ignored
+                return
+            self.stop()
+            self.table = ChessAi.TranspositionTable(sizeMB=sizeMB)
+        elif name.lower() in ("ownbook", "bookfile"):
+            self.stop()
+            if name.lower() == "ownbook":
+                self.ownBook = value.lower() == "true"
+            else:
+                self.bookPath = value
+            self.book.close()
+            self.book = ChessBook.OpeningBook(self.bookPath if self.ownBook else None)
+        elif name.lower() == "syzygypath":
+            self.stop()
+            self.tablebase.close()
+            self.tablebase = ChessTablebase.Tablebase(value)
+
+    '''
+    position [startpos | fen <fen>] [moves <move1> ... <movei>]
+    '''
+    def setPosition(self, tokens):
+        movesIndex = tokens.index("moves") if "moves" in tokens else len(tokens)
+        if tokens[0] == "fen":
+            try:
+                self.gs = ChessEngine.GameState.fromFEN(" ".join(tokens[1:movesIndex]))
+            except ValueError as error: #the position before stays
+                send("info string " + str(error))
+                return
+        else:
+            self.gs = ChessEngine.GameState()
+        for notation in tokens[movesIndex + 1:]:
+            for move in self.gs.getValidMoves():
+                if move.getChessNotation() == notation:
+                    self.gs.makeMove(move)
+                    break
+            else:
+                send("info string illegal move " + notation)
+                break
+
+    '''
+    go [depth n] [movetime ms] [nodes n] [wtime ms] [btime ms] [winc ms] [binc ms] [movestogo n] [infinite]
+    '''
+    def go(self, tokens):
+        options = {}
+        for i in range(len(tokens) - 1):
+            if tokens[i] in ("depth", "movetime", "nodes", "wtime", "btime", "winc", "binc", "movestogo"):
+                try:
+                    options[tokens[i]] = int(tokens[i + 1])
+                except ValueError: #not a number, searched as if the limit wasn't given
+                    continue
+        maxDepth = options.get("depth", ChessAi.MAX_DEPTH)
+        nodeLimit = options.get("nodes")
+        clock = options.get("wtime" if self.gs.whiteToMove else "btime")
+        if "movetime" in options:
+            timeLimit = max(0.01, options["movetime"] / 1000 - MOVE_OVERHEAD)
+        elif clock is not None:
+            increment = options.get("winc" if self.gs.whiteToMove else "binc", 0)
+            timeLimit = clock / options.get("movestogo", DEFAULT_MOVES_TO_GO) / 1000 + increment / 1000
+            timeLimit = max(0.01, min(timeLimit, clock / 1000 / 2) - MOVE_OVERHEAD)
+        else: #depth, nodes or infinite, search until that limit or "stop"
+            timeLimit = None
+        self.stopEvent.clear()
+        infinite = "infinite" in tokens
+        self.searchThread = threading.Thread(target=self.search, args=(self.gs, timeLimit, nodeLimit, maxDepth, infinite))
+        self.searchThread.start()
+
+    '''
+    Runs in the search thread. After "go infinite" the bestmove waits for "stop" even if the search ends by itself,
+    at a mate or MAX_DEPTH, as UCI asks
+    '''
+    def search(self, gs, timeLimit, nodeLimit, maxDepth, infinite):
+        returnQueue = queue.Queue()
+        validMoves = gs.getValidMoves()
+        if len(validMoves) == 0:
+            if infinite:
+                self.stopEvent.wait()
+            send("bestmove 0000")
+            return
+        ChessAi.findBestMove(gs, validMoves, returnQueue, timeLimit, nodeLimit, maxDepth, self.sendInfo, table=self.table,
+                             stopCondition=self.stopEvent.is_set, book=self.book, tablebase=self.tablebase)
+        bestMove = returnQueue.get()
+        if bestMove is None: #stopped before depth 1 finished
+            bestMove = validMoves[0]
+        if infinite:
+            self.stopEvent.wait()
+        send("bestmove " + bestMove.getChessNotation())
+
+    '''
+    Streams an info line for every depth the search finishes
+    '''
+    def sendInfo(self, depth, score, nodes, seconds, pv):
+        send("info depth %d score %s nodes %d nps %d time %d pv %s" % (depth, uciScore(score), nodes,
+             nodes / seconds if seconds > 0 else 0, seconds * 1000, " ".join(move.getChessNotation() for move in pv)))
+
+    '''
+    Stops the running search, which still answers with its best move, and waits for it
+    '''
+    def stop(self):
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+def main():
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
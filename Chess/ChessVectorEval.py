@@ -0,0 +1,131 @@
+"""
+Batched evaluation of many positions at once with NumPy, for tuning and analysis. Positions are (N, 64) int8 arrays of
+the ChessEngine.pieceCodes, the same flat board a PositionSnapshot holds, or (N, 12, 64) one-hot piece planes. The
+score is the static part of ChessAi.scoreBoard, material plus piece position tables in centipawns for white, read from
+the same tables the GameStates keep their running evaluation with, so the two agree exactly. Checkmate and stalemate
+need move generation and aren't looked at. NumPy is optional, the rest of the engine doesn't need it.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+import ChessEngine
+
+PIECE_PLANES = 12 #one plane for every piece code but the empty square
+CHUNK_SIZE = 16384 #positions scored at a time, small enough for the temporaries to stay in cache
+
+def requireNumpy():
+    if np is None:
+        raise ImportError("ChessVectorEval needs numpy, install it with pip install numpy")
+
+'''
+Centipawn value of every piece code on every square as a (13, 64) array, row 0 is the empty square. Built from
+ChessEngine.materialValues and positionValues, call it again after ChessAi.updateEvaluationTables
+'''
+def evaluationWeights():
+    requireNumpy()
+    weights = np.zeros((len(ChessEngine.pieceNames), 64), dtype=np.int32)
+    for code, piece in enumerate(ChessEngine.pieceNames):
+        if piece == "--":
+            continue
+        table = ChessEngine.positionValues[piece]
+        weights[code] = [ChessEngine.materialValues[piece] + table[r][c] for r in range(8) for c in range(8)]
+    return weights
+
+'''
+The flat 64 byte board of a FEN's piece placement, without setting up a GameState
+'''
+def squaresFromFEN(fen):
+    squares = bytearray()
+    for char in fen.split(None, 1)[0]:
+        if char.isdigit():
+            squares.extend(bytes(int(char)))
+        elif char != '/':
+            piece = ('w' if char.isupper() else 'b') + (char.lower() if char in "pP" else char.upper())
+            squares.append(ChessEngine.pieceCodes[piece])
+    if len(squares) != 64:
+        raise ValueError("bad FEN placement: " + fen)
+    return bytes(squares)
+
+'''
+(N, 64) int8 array of positions from GameStates, PositionSnapshots, FEN strings or 64 byte boards
+'''
+def encodePositions(positions):
+    requireNumpy()
+    boards = []
+    for position in positions:
+        if isinstance(position, ChessEngine.GameState):
+            position = position.snapshot()
+        if isinstance(position, ChessEngine.PositionSnapshot):
+            position = position.squares
+        elif isinstance(position, str):
+            position = squaresFromFEN(position)
+        boards.append(position)
+    return np.frombuffer(b"".join(boards), dtype=np.int8).reshape(len(boards), 64)
+
+'''
+(N, 12, 64) one-hot planes of an (N, 64) array, plane p is set where piece code p + 1 stands
+'''
+def toPlanes(squares):
+    requireNumpy()
+    return (squares[:, None, :] == np.arange(1, PIECE_PLANES + 1, dtype=np.int8)[None, :, None]).astype(np.int8)
+
+'''
+Weights of every pair of squares (2k, 2k+1) as a (32, 169) array, entry code1 * 13 + code2 is what the two pieces on
+them are worth together. Looking pairs up halves the number of passes over the batch
+'''
+def squarePairWeights(weights):
+    squareWeights = weights.T.astype(np.float64 if weights.dtype.kind == 'f' else np.int32) #(64, 13)
+    return (squareWeights[0::2, :, None] + squareWeights[1::2, None, :]).reshape(32, -1).copy()
+
+'''
+Static scores in centipawns for white of a batch of positions, (N, 64) piece codes or (N, 12, 64) planes. weights
+defaults to evaluationWeights(), float weights (as a tuner uses) give float scores. The piece codes are the fast
+input, a few million positions a second on one core
+'''
+def scorePositions(positions, weights=None):
+    requireNumpy()
+    if weights is None:
+        weights = evaluationWeights()
+    floatWeights = weights.dtype.kind == 'f'
+    scores = np.empty(len(positions), dtype=np.float64 if floatWeights else np.int64)
+    if positions.ndim == 3: #planes: one dot product with all the weights, exact in float32 as every sum stays far below 2**24
+        flatWeights = weights[1:].reshape(-1).astype(np.float32)
+        for start in range(0, len(positions), CHUNK_SIZE):
+            chunk = positions[start:start + CHUNK_SIZE]
+            chunkScores = chunk.reshape(len(chunk), -1).astype(np.float32) @ flatWeights
+            scores[start:start + len(chunk)] = chunkScores if floatWeights else np.rint(chunkScores)
+        return scores
+    #piece codes: square major so every pass reads one contiguous row, then one table lookup per pair of squares
+    pairWeights = squarePairWeights(weights)
+    for start in range(0, len(positions), CHUNK_SIZE):
+        squares = np.ascontiguousarray(positions[start:start + CHUNK_SIZE].T).astype(np.int16)
+        pairIndexes = squares[0::2] * len(ChessEngine.pieceNames) + squares[1::2]
+        total = np.zeros(squares.shape[1], dtype=pairWeights.dtype)
+        pairScores = np.empty(squares.shape[1], dtype=pairWeights.dtype)
+        for pair in range(32):
+            np.take(pairWeights[pair], pairIndexes[pair], out=pairScores)
+            total += pairScores
+        scores[start:start + len(total)] = total
+    return scores
+
+'''
+For every piece code and square, the sum of values over the positions of an (N, 64) batch that have that piece on
+that square, as a (13, 64) array. It is the gradient of sum(values * scorePositions(positions, weights)) with respect
+to the weights, which is what a tuner needs
+'''
+def squareWeightSums(positions, values):
+    requireNumpy()
+    codeCount = len(ChessEngine.pieceNames)
+    pairSums = np.zeros((32, codeCount * codeCount))
+    for start in range(0, len(positions), CHUNK_SIZE):
+        squares = np.ascontiguousarray(positions[start:start + CHUNK_SIZE].T).astype(np.int16)
+        pairIndexes = squares[0::2] * codeCount + squares[1::2]
+        chunkValues = values[start:start + squares.shape[1]]
+        for pair in range(32):
+            pairSums[pair] += np.bincount(pairIndexes[pair], weights=chunkValues, minlength=codeCount * codeCount)
+    pairSums = pairSums.reshape(32, codeCount, codeCount)
+    sums = np.empty((codeCount, 64))
+    sums[:, 0::2] = pairSums.sum(axis=2).T #the first square of a pair is the row index
+    sums[:, 1::2] = pairSums.sum(axis=1).T
+    return sums